@@ -0,0 +1,180 @@
+# pyng自身开销的基准测试：网表生成和写入、raw文件读取、端到端run的吞吐量。
+# 使用fake_ngspice.py代替ngspice，不需要安装ngspice。
+#   python bench/bench_pyng.py                 运行并打印结果
+#   python bench/bench_pyng.py --save          运行并把结果保存为基准（bench/baseline.json）
+#   python bench/bench_pyng.py --compare       与保存的基准比较，变慢超过阈值时返回1
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import numpy as np
+
+bench_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(bench_dir))
+sys.path.insert(0, bench_dir)
+from pyng import NgSim
+from fake_ngspice import write_raw
+
+fake_ngspice = os.path.join(bench_dir, "fake_ngspice.py")
+default_baseline = os.path.join(bench_dir, "baseline.json")
+
+
+def best_of(fn, repeat, min_time=0.2):
+    # 取多次运行中最短的时间，减少机器负载的影响；很快的操作至少重复运行min_time秒
+    best = float('inf')
+    count = 0
+    begin = time.perf_counter()
+    while count < repeat or (time.perf_counter() - begin < min_time and count < 1000):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+        count += 1
+    return best
+
+
+def write_netlist(fname, elements):
+    # 生成含有elements个元件的大网表：电阻梯形网络加一个子电路
+    with open(fname, 'w') as f:
+        f.write("* large benchmark netlist\n")
+        f.write(".subckt cell a b\nR1 a b 1k\nC1 b 0 1p\n.ends\n")
+        f.write("V1 n0 0 dc 0 ac 1\n")
+        for i in range(elements):
+            f.write(f"R{i + 1} n{i} n{i + 1} 1k\n")
+            if i % 10 == 0:
+                f.write("+ tc1=0\n")
+        f.write(f"X1 n{elements} 0 cell\n")
+        f.write(".end\n")
+
+
+def bench_netlist(folder, elements, repeat):
+    netlist = os.path.join(folder, f"large_{elements}.cir")
+    write_netlist(netlist, elements)
+    results = {}
+    results[f"netlist_parse_{elements}"] = best_of(lambda: NgSim(netlist, folder, verbose=False), repeat)
+    ns = NgSim(netlist, os.path.join(folder, "work"), verbose=False)
+    ns.add_dot_command(".ac lin 100 1Meg 100Meg")
+    values = iter(range(10**9))
+
+    def setup():
+        # 每次修改一个元件值，避免因网表未变而跳过写入
+        ns.add_mod_comp("r1", f"{next(values)}")
+        ns.setup_working_dir()
+
+    results[f"setup_working_dir_{elements}"] = best_of(setup, repeat)
+    return results
+
+
+def bench_rawread(folder, sizes, kinds, repeat):
+    results = {}
+    ns = NgSim.__new__(NgSim) # rawread不使用网表
+    for kind in kinds:
+        for points in sizes:
+            fname = os.path.join(folder, f"{kind}_{points}.raw")
+            write_raw(fname, kind, points)
+
+            def read():
+                # 读取并遍历所有向量，包括映射文件的实际读取
+                arrs, plots = ns.rawread(fname)
+                for arr in arrs:
+                    for name in arr.dtype.names:
+                        np.sum(arr[name])
+
+            results[f"rawread_{kind}_{points}"] = best_of(read, repeat)
+            os.remove(fname)
+    return results
+
+
+def bench_run(folder, points, runs, repeat):
+    netlist = os.path.join(folder, "run.cir")
+    write_netlist(netlist, 100)
+    os.environ["FAKE_NGSPICE_POINTS"] = str(points)
+    ns = NgSim(netlist, os.path.join(folder, "run"), verbose=False)
+    ns.ngspice = fake_ngspice
+    ns.add_dot_command(".ac lin 100 1Meg 100Meg")
+    values = iter(range(10**9))
+
+    def run():
+        for _ in range(runs):
+            ns.add_mod_comp("r1", f"{next(values)}")
+            ns.run()
+
+    def run_many():
+        jobs = []
+        for _ in range(runs):
+            ns.add_mod_comp("r1", f"{next(values)}")
+            jobs.append(ns.snapshot())
+        ns.run_many(jobs)
+
+    return {f"run_{points}": best_of(run, repeat)/runs,
+            f"run_many_{points}": best_of(run_many, repeat)/runs}
+
+
+def compare(results, baseline, tolerance, min_delta):
+    regressions = []
+    print(f"{'benchmark':<32}{'baseline':>12}{'now':>12}{'ratio':>8}")
+    for name, value in results.items():
+        if name not in baseline['results']:
+            print(f"{name:<32}{'-':>12}{value:>12.6f}")
+            continue
+        base = baseline['results'][name]
+        ratio = value/base if base > 0 else float('inf')
+        # 很短的测量受机器负载影响大，绝对差小于min_delta时不算变慢
+        flag = " slower" if ratio > 1 + tolerance and value - base > min_delta else ""
+        print(f"{name:<32}{base:>12.6f}{value:>12.6f}{ratio:>8.2f}{flag}")
+        if flag:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark pyng overhead with a fake ngspice.")
+    parser.add_argument('--sizes', type=float, nargs='+', default=[1e3, 1e4, 1e5, 1e6, 1e7],
+                        help="Points per plot for the rawread benchmarks")
+    parser.add_argument('--kinds', nargs='+', default=['ac', 'tran', 'noise'],
+                        help="Raw file kinds for the rawread benchmarks")
+    parser.add_argument('--elements', type=int, nargs='+', default=[1000, 100000],
+                        help="Netlist sizes for the parse and setup_working_dir benchmarks")
+    parser.add_argument('--run-points', type=int, default=10000, help="Points per run for run()")
+    parser.add_argument('--runs', type=int, default=20, help="Runs per run()/run_many measurement")
+    parser.add_argument('--repeat', type=int, default=3, help="Repeats; the best time is kept")
+    parser.add_argument('--save', nargs='?', const=default_baseline, help="Save the results as baseline")
+    parser.add_argument('--compare', nargs='?', const=default_baseline, help="Compare with a baseline")
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help="Allowed slowdown against the baseline before failing")
+    parser.add_argument('--min-delta', type=float, default=2.5e-4,
+                        help="Ignore slowdowns smaller than this many seconds")
+    args = parser.parse_args()
+
+    folder = tempfile.mkdtemp(prefix="pyng_bench_")
+    try:
+        results = {}
+        for elements in args.elements:
+            results.update(bench_netlist(folder, elements, args.repeat))
+        results.update(bench_rawread(folder, [int(size) for size in args.sizes], args.kinds, args.repeat))
+        results.update(bench_run(folder, args.run_points, args.runs, args.repeat))
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance, args.min_delta)
+        if regressions:
+            print("Regressions:", ", ".join(regressions))
+            return 1
+    else:
+        for name, value in results.items():
+            print(f"{name:<32}{value:>12.6f} s")
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'machine': platform.platform(), 'python': platform.python_version(),
+                       'numpy': np.__version__, 'results': results}, f, indent=1)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+# 代替ngspice的假程序：不进行仿真，只按环境变量写出指定大小的二进制raw文件，
+# 用于在没有安装ngspice的机器上测试pyng自身的开销。
+#   FAKE_NGSPICE_KIND    ac/tran/noise，默认ac
+#   FAKE_NGSPICE_POINTS  每个plot的数据点数，默认取网表中.ac lin N f1 f2的N，没有时为10000
+#   FAKE_NGSPICE_VARS    除横轴外的向量数，默认2
+#   FAKE_NGSPICE_PLOTS   重复写出的分析个数，默认1（noise每次写出两个plot）
+#   FAKE_NGSPICE_SLEEP   写出raw文件之前等待的秒数，默认0（测试超时）
+#   FAKE_NGSPICE_SCALE   元件名，设置时v(n*)乘以网表中这个元件的值（测试结果与任务的对应）
+#   FAKE_NGSPICE_Q       设置时ac的v(n*)为中心频率20MHz*(i+1)、品质因数Q的带通响应，而不是一阶低通
+#   FAKE_NGSPICE_FAIL    设置时把这条信息（如Timestep too small）输出到标准输出，不写raw文件并返回1
+#   FAKE_NGSPICE_UNLESS  网表中含有这段文字（不区分大小写，如method=gear）时FAKE_NGSPICE_FAIL不生效
+# ac的频率范围取网表中.ac lin N f1 f2的f1到f2，没有时为1MHz到100MHz；
+# 网表中的.meas ac 名称 max/min vm(n*)在标准输出中按ngspice的格式输出结果，其他测量输出failed
+# -p时从标准输入读取source、alter、run、echo、quit等命令（见interactive）
+# 网表含有.control控制块且没有-r时执行其中的set appendwrite、foreach/end、alter、
+# ac/noise/tran分析、write、setplot previous和destroy all（alter改变SCALE元件的值）
+import os
+import sys
+import time
+import numpy as np
+
+
+def plot_bytes(plotname, flags, data, units):
+    """One binary plot (header and data) as written by ngspice."""
+    names = data.dtype.names
+    header = (f"Title: fake ngspice\nDate: Thu Jan  1 00:00:00  1970\nPlotname: {plotname}\n"
+              f"Flags: {flags}\nNo. Variables: {len(names)}\nNo. Points: {len(data)}\nVariables:\n")
+    for i, (name, unit) in enumerate(zip(names, units)):
+        header += f"\t{i}\t{name}\t{unit}\n"
+    return (header + "Binary:\n").encode() + data.tobytes()
+
+
+SUFFIXES = {'t': 1e12, 'g': 1e9, 'meg': 1e6, 'k': 1e3, 'm': 1e-3, 'u': 1e-6, 'n': 1e-9, 'p': 1e-12, 'f': 1e-15}
+
+
+def spice_number(text):
+    """Value of a SPICE number such as 2.5k or 100Meg."""
+    text = text.lower()
+    for suffix in sorted(SUFFIXES, key=len, reverse=True):
+        if text.endswith(suffix):
+            return float(text[:-len(suffix)])*SUFFIXES[suffix]
+    return float(text)
+
+
+def component_value(netlist, name):
+    """Value of the named element in a netlist file (SPICE suffixes allowed), or 1."""
+    with open(netlist) as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) >= 4 and parts[0].lower() == name.lower():
+                return spice_number(parts[3])
+    return 1.0
+
+
+def ac_grid(netlist):
+    """(points, f_start, f_stop) of the first '.ac lin' line of a netlist file, or None."""
+    with open(netlist) as f:
+        for line in f:
+            parts = line.lower().split()
+            if len(parts) >= 5 and parts[:2] == ['.ac', 'lin']:
+                return int(spice_number(parts[2])), spice_number(parts[3]), spice_number(parts[4])
+    return None
+
+
+def ac_response(freq, i, scale=1.0, q=None):
+    """AC response of vector v(n<i>): a first-order low-pass at 20 MHz*(i+1),
+    or a band-pass of quality factor q centred there, times scale."""
+    f0 = 20e6*(i + 1)
+    if q is None:
+        return scale/(1 + 1j*freq/f0)
+    s = 1j*freq/f0
+    return scale*(s/q)/(s**2 + s/q + 1)
+
+
+def print_meas(netlist, scale=1.0, q=None):
+    """Print the netlist's '.meas ac <name> max|min vm(n<i>)' results on the
+    AC grid like ngspice in batch mode; other measurements fail."""
+    points, f_start, f_stop = ac_grid(netlist) or (10000, 1e6, 100e6)
+    freq = np.linspace(f_start, f_stop, int(float(os.environ.get("FAKE_NGSPICE_POINTS", points))))
+    with open(netlist) as f:
+        for line in f:
+            parts = line.lower().split()
+            if len(parts) < 3 or parts[0] != '.meas':
+                continue
+            name = parts[2]
+            if parts[1] == 'ac' and len(parts) > 4 and parts[3] in ('max', 'min') and parts[4].startswith('vm(n'):
+                mag = np.abs(ac_response(freq, int(parts[4][4:-1]), scale, q))
+                k = np.argmax(mag) if parts[3] == 'max' else np.argmin(mag)
+                print(f"{name:<20}=  {mag[k]:e} at=  {freq[k]:e}")
+            else:
+                print(f"{name:<20}=  failed")
+
+
+def synthetic_plots(kind="ac", points=10000, n_vars=2, n_plots=1, scale=1.0,
+                    f_start=1e6, f_stop=100e6, q=None):
+    """Synthetic plots shaped like ngspice's AC, transient or noise output;
+    the v(n*) vectors are multiplied by scale. AC vectors are first-order
+    low-passes, or band-passes of quality factor q when q is given."""
+    plots = []
+    for _ in range(n_plots):
+        if kind == "ac":
+            freq = np.linspace(f_start, f_stop, points)
+            data = np.empty(points, dtype=[('frequency', np.complex128)] +
+                            [(f'v(n{i})', np.complex128) for i in range(n_vars)])
+            data['frequency'] = freq
+            for i in range(n_vars):
+                data[f'v(n{i})'] = ac_response(freq, i, scale, q)
+            plots.append(plot_bytes("AC Analysis", "complex", data, ['frequency'] + ['voltage']*n_vars))
+        elif kind == "tran":
+            t = np.linspace(0, 3e-6, points)
+            data = np.empty(points, dtype=[('time', np.float64)] +
+                            [(f'v(n{i})', np.float64) for i in range(n_vars)])
+            data['time'] = t
+            for i in range(n_vars):
+                data[f'v(n{i})'] = scale*np.sin(2*np.pi*20e6*t + i)
+            plots.append(plot_bytes("Transient Analysis", "real", data, ['time'] + ['voltage']*n_vars))
+        elif kind == "noise":
+            freq = np.linspace(1e6, 100e6, points)
+            data = np.empty(points, dtype=[('frequency', np.float64), ('onoise_spectrum', np.float64)])
+            data['frequency'] = freq
+            data['onoise_spectrum'] = 1e-8/np.sqrt(1 + (freq/20e6)**2)
+            total = np.ones(1, dtype=[('onoise_total', np.float64)])
+            plots.append(plot_bytes("Noise Spectral Density Curves", "real", data, ['frequency', 'V^2/Hz']))
+            plots.append(plot_bytes("Integrated Noise", "real", total, ['V^2']))
+        else:
+            raise ValueError(f"Unknown kind {kind}")
+    return plots
+
+
+def write_raw(fname, kind="ac", points=10000, n_vars=2, n_plots=1, scale=1.0, **options):
+    with open(fname, 'wb') as f:
+        for plot in synthetic_plots(kind, points, n_vars, n_plots, scale, **options):
+            f.write(plot)
+
+
+def control_lines(netlist):
+    """Lines between .control and .endc of a netlist file (empty if none)."""
+    lines = []
+    inside = False
+    with open(netlist) as f:
+        for line in f:
+            word = line.strip().lower()
+            if word == '.control':
+                inside = True
+            elif word == '.endc':
+                inside = False
+            elif inside and word:
+                lines.append(line.strip())
+    return lines
+
+
+def analysis_plots(analysis, scale, q=None):
+    """Plots written by one control-block analysis line such as 'ac lin 100 1meg 100meg'."""
+    parts = analysis.lower().split()
+    points = os.environ.get("FAKE_NGSPICE_POINTS")
+    options = {'q': q} if parts[0] == 'ac' else {}
+    if parts[:2] == ['ac', 'lin']:
+        options.update(f_start=spice_number(parts[3]), f_stop=spice_number(parts[4]))
+        points = points or parts[2]
+    return synthetic_plots(parts[0], int(spice_number(points or "10000")),
+                           int(os.environ.get("FAKE_NGSPICE_VARS", 2)), 1, scale, **options)
+
+
+def run_control(netlist, lines, state, variables=None):
+    """Execute control-block lines. state holds the altered element values,
+    the plots of the current run, the index of the current plot, whether
+    appendwrite is set and the band-pass q; variables are foreach values."""
+    variables = {} if variables is None else variables
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        for name, value in variables.items():
+            line = line.replace('$' + name, value)
+        parts = line.split()
+        word = parts[0].lower()
+        if word == 'foreach':
+            # 找到配对的end，对每个值执行循环体
+            depth, end = 1, i + 1
+            while depth:
+                depth += {'foreach': 1, 'end': -1}.get(lines[end].split()[0].lower(), 0)
+                end += 1
+            for value in parts[2:]:
+                run_control(netlist, lines[i + 1:end - 1], state, {**variables, parts[1]: value})
+            i = end
+            continue
+        if word == 'set' and parts[1:] == ['appendwrite']:
+            state['appendwrite'] = True
+        elif word == 'alter':
+            name, value = line[len('alter'):].split('=')
+            state['values'][name.strip().lower()] = spice_number(value.strip())
+        elif word in ('ac', 'noise', 'tran'):
+            component = os.environ.get("FAKE_NGSPICE_SCALE")
+            scale = 1.0
+            if component:
+                scale = state['values'].get(component.lower(), component_value(netlist, component))
+            state['plots'] += analysis_plots(line, scale, state['q'])
+            state['current'] = len(state['plots']) - 1
+        elif word == 'setplot' and parts[1:] == ['previous']:
+            state['current'] -= 1
+        elif word == 'write':
+            with open(parts[1], 'ab' if state['appendwrite'] else 'wb') as f:
+                f.write(state['plots'][state['current']])
+        elif word == 'destroy' and parts[1:] == ['all']:
+            state['plots'] = []
+            state['current'] = -1
+        i += 1
+
+
+def interactive(stdin, stdout):
+    """Pipe mode (ngspice -p): source loads a netlist, alter changes an
+    element value, run <file> writes the raw file like -r, echo prints its
+    arguments and quit exits. FAKE_NGSPICE_SLEEP delays every run."""
+    netlist = None
+    values = {}
+    for line in stdin:
+        parts = line.split()
+        if not parts:
+            continue
+        word = parts[0].lower()
+        if word == 'quit':
+            break
+        if word == 'echo':
+            print(" ".join(parts[1:]), file=stdout, flush=True)
+        elif word == 'source':
+            netlist = parts[1]
+            values = {}
+        elif word == 'remcirc':
+            netlist = None
+        elif word == 'alter':
+            name, value = line.strip()[len('alter'):].split('=')
+            values[name.strip().lower()] = spice_number(value.strip())
+        elif word == 'run':
+            time.sleep(float(os.environ.get("FAKE_NGSPICE_SLEEP", 0)))
+            if netlist is None:
+                print("Error: there aren't any circuits loaded.", file=stdout, flush=True)
+                continue
+            component = os.environ.get("FAKE_NGSPICE_SCALE")
+            scale = 1.0
+            if component:
+                scale = values.get(component.lower(), component_value(netlist, component))
+            points, f_start, f_stop = ac_grid(netlist) or (10000, 1e6, 100e6)
+            write_raw(parts[1], os.environ.get("FAKE_NGSPICE_KIND", "ac"),
+                      int(float(os.environ.get("FAKE_NGSPICE_POINTS", points))),
+                      int(os.environ.get("FAKE_NGSPICE_VARS", 2)), 1, scale,
+                      f_start=f_start, f_stop=f_stop)
+    return 0
+
+
+def main(args):
+    if '-v' in args or '--version' in args:
+        print("******\n** ngspice-0 : fake ngspice for benchmarks\n******")
+        return 0
+    if '-p' in args:
+        return interactive(sys.stdin, sys.stdout)
+    if not args or not os.path.exists(args[-1]):
+        print("fake ngspice: netlist not found", file=sys.stderr)
+        return 1
+    time.sleep(float(os.environ.get("FAKE_NGSPICE_SLEEP", 0)))
+    if os.environ.get("FAKE_NGSPICE_FAIL"):
+        with open(args[-1]) as f:
+            fixed = os.environ.get("FAKE_NGSPICE_UNLESS")
+            if not fixed or fixed.lower() not in f.read().lower():
+                print("Circuit: fake ngspice\n" + os.environ["FAKE_NGSPICE_FAIL"])
+                return 1
+    q = float(os.environ["FAKE_NGSPICE_Q"]) if os.environ.get("FAKE_NGSPICE_Q") else None
+    if '-r' not in args and control_lines(args[-1]):
+        run_control(args[-1], control_lines(args[-1]),
+                    {'values': {}, 'appendwrite': False, 'plots': [], 'current': -1, 'q': q})
+    scale = (component_value(args[-1], os.environ["FAKE_NGSPICE_SCALE"])
+             if os.environ.get("FAKE_NGSPICE_SCALE") else 1.0)
+    if '-r' in args:
+        points, f_start, f_stop = ac_grid(args[-1]) or (10000, 1e6, 100e6)
+        write_raw(args[args.index('-r') + 1],
+                  os.environ.get("FAKE_NGSPICE_KIND", "ac"),
+                  int(float(os.environ.get("FAKE_NGSPICE_POINTS", points))),
+                  int(os.environ.get("FAKE_NGSPICE_VARS", 2)),
+                  int(os.environ.get("FAKE_NGSPICE_PLOTS", 1)),
+                  scale, f_start=f_start, f_stop=f_stop, q=q)
+    print("Circuit: fake ngspice")
+    print_meas(args[-1], scale, q)
+    print("Total analysis time (seconds) = 0\nTotal elapsed time (seconds) = 0")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -1,8 +1,8 @@
 # 对于特定反馈电感Lf型号，改变补偿电感Lc，寻找使得带宽变为1MHz的反馈电阻Rf，观察带宽均为1MHz时补偿电感与反馈电阻的关系：
 import numpy as np
 import argparse
-from pyng import NgSim
-import pickle
+from pyng import NgSim, response_metrics, ResultStore, Sweep, SweepTask, SweepCheck, ModelLibrary, Surrogate, RETRY_LADDER, \
+    monte_carlo, summary_statistics
 import matplotlib.pyplot as plt
 from rich.progress import Progress,TimeElapsedColumn
 import os
@@ -46,377 +46,150 @@ bandwidth_precision = 1/100   # 带宽精度
 minimum_Rf = 1 # 在找不到大于目标带宽的Rf时保障Rf不小于这个最小值
 maximum_Rf = 1000 # 在找不到小于目标带宽的Rf时保障Rf不大于这个最小值
 
+# 结果存储
+store_traces = False # 是否同时保存每个Lc点的完整增益曲线
+
+# 蒙特卡洛容差分析：设计点（扫描得到的一组元件值）、各元件的分布和合格标准
+mc_point = {'xl1': '1812cs103', 'c2': '6.16p', 'r2': '26.36k', 'l2': '1.4u'}
+mc_distributions = {'c2': ('normal', 6.16e-12, 0.05/3),     # 电容±5%（3σ）
+                    'r2': ('normal', 26.36e3, 0.01/3),      # 电阻±1%（3σ）
+                    'l2': ('normal', 1.4e-6, 0.05/3),       # 补偿电感±5%（3σ）
+                    'l.xl1.l1': ('normal', 10e-6, 0.10/3)}  # 反馈电感模型内部电感±10%（3σ）
+mc_samples = 2000
+mc_seed = 1
+mc_peak_tolerance = 0.02      # 峰值频率与目标的最大相对偏差
+mc_bandwidth_tolerance = 0.05 # 带宽与目标的最大相对偏差
+
+def gain_ramp(arrs):
+    # 取出ac仿真的频率和跨阻增益
+    freq = np.real(arrs[0]['frequency'])
+    vout = arrs[0]['v(out)']
+    iin = arrs[0]['i(v5)']
+    ramp = np.abs(vout)/np.abs(iin)
+    return freq, ramp
+
+def Cf_theory(point):
+    # 电容数值以pF为单位，搜索的初始值取反馈电感在20MHz谐振的理论值
+    return 1/(np.pow((2*np.pi*20e6),2)*Lf_dict[point['xl1']]*1e-6)*1e12
+
+def ramp_metrics(arrs, plots):
+    # 取出找到的Rf对应的增益峰值、增益带宽、增益峰值位置
+    freq, ramp = gain_ramp(arrs)
+    metrics = response_metrics(freq, ramp)
+    result = {'peak_value_ramp': metrics['peak_value'], 'f_peak_ramp': metrics['f_peak'],
+              'f_low_ramp': metrics['f_low'], 'f_high_ramp': metrics['f_high'],
+              'bandwidth_ramp': metrics['bandwidth'],
+              'ramp_valid': metrics['valid']} # 表征找到的带宽是否是真实带宽而非仿真频率宽度不够导致的带宽
+    if store_traces:
+        result['ramp'] = ramp
+    return result
+
+def out_noise(arrs, plots, row):
+    # 找到信号峰值处对应的噪声值（根据避免ngspice bug之后的仿真实验，发现噪声不具有峰值特性，而呈现谷状特性）
+    freq = np.real(arrs[0]['frequency'])
+    out_noise_density = arrs[0]['onoise_spectrum']
+    return {'out_noise_at_sig_peak': np.interp(row['f_peak_ramp'], freq, out_noise_density)}
+
+def oscillating(arr):
+    # 通过tran仿真的最大vout是否大于1v来判断是否自激；监视时arr只是新写出的行，同样适用
+    return np.max(np.abs(np.real(arr['v(out)']))) > 1
+
+def stability(arrs, plots, row):
+    # tran仿真在vout超过1v时提前结束，部分结果同样可以判断
+    return {'sim_stable': not oscillating(arrs[0])}
+
+def build_sweep(ns, journal=None):
+    ac_command = "ac " + dot_distribution + " " + str(sim_freq_low) + "Meg " + str(sim_freq_high) + "Meg"
+    # 每个反馈电感先搜索Cf：搜索时固定Lc和Rf，网表不随Lc变化，因此每个Lf只搜索一次；
+    # 峰值频率随Cf单调变化，取峰值频率不低于目标频率且足够接近的Cf（电容值保留两位小数）
+    Cf_task = SweepTask("Cf", "c2", lambda arrs, plots: response_metrics(*gain_ramp(arrs))['f_peak'],
+                        target_peak_freq, (minimum_Cf, maximum_Cf), target_peak_freq*peak_precision,
+                        x0=Cf_theory, unit='p', precision=2, side="above", max_sims=max_Cf_search_round,
+                        changes={'l2': Lc_Cf_search_str,
+                                 'r2': np.format_float_positional(Rf_start,precision=2,unique=False) + 'k'},
+                        warm_start=False)
+    # 然后对每个Lc搜索带宽最接近1MHz的反馈电阻：带宽随Rf单调减小，取带宽不低于目标带宽且足够接近的Rf
+    # （电阻数值以kOhm为单位，保留两位小数）。Rf(Lf, Lc)是光滑的曲面，用已经找到的点拟合代理模型
+    # 预测初始值和区间，第一个点从Rf_start开始，没有预测时从上一个Lc的结果开始搜索
+    Rf_task = SweepTask("Rf", "r2", lambda arrs, plots: response_metrics(*gain_ramp(arrs))['bandwidth'],
+                        target_bandwidth, (minimum_Rf, maximum_Rf), target_bandwidth*bandwidth_precision,
+                        x0=Rf_start, unit='k', precision=2, side="above", max_sims=max_Rf_search_round,
+                        measure=ramp_metrics, surrogate=Surrogate(),
+                        features=lambda point: (Lf_dict[point['xl1']], point['l2']))
+    # 找到最佳电阻值之后，进行tran仿真判断是否自激、noise仿真得到噪声。
+    # 需注意，由于ngspice本身的bug（ver44.2），在ac仿真同时进行noise仿真会导致noise仿真结果不可靠，因此此处分开仿真。
+    # tran仿真运行时监视vout，一旦超过1v即可判定自激，结束仿真，不再运行剩余的时间
+    stability_check = SweepCheck("stability", ["tran 3n 3u"], stability, watch=oscillating)
+    noise_check = SweepCheck("noise", ["noise v(out) i1 " + dot_distribution + " " + \
+                                       str(sim_freq_low) + "Meg " + str(sim_freq_high) + "Meg"],
+                             out_noise)
+    return Sweep(ns,
+                 axes={'xl1': list(Lf_dict), 'l2': np.arange(Lc_low,Lc_high,Lc_delta)},
+                 units={'l2': ('u', 4)}, # 电感数值以uH为单位
+                 dot_commands=[ac_command], tasks=[Cf_task, Rf_task], checks=[stability_check, noise_check],
+                 journal=journal, errors="skip") # 仿真失败的点跳过，不中止整个扫描
+
 def sim():
     ########################################
     # 开始进行仿真运算
     ########################################
 
     ns = NgSim("idealC_1812cs103_compensate_idealL.cir","ngspice_working_folder",verbose=False)
-    data = {}
-    Lc_list = np.arange(Lc_low,Lc_high,Lc_delta)
+    # 反馈电感和运放的模型从components文件夹中按网表引用的子电路自动include
+    ns.model_library = ModelLibrary(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'components'))
+    # 单次仿真最多运行60秒；不收敛时依次放宽.options重新仿真
+    ns.timeout = 60
+    ns.retry_ladder = RETRY_LADDER
+    # 每个Lc点的结果在得到后立即追加到结果文件夹中；journal记录已经完成的搜索和点，
+    # 中断后重新运行会跳过已经完成的点
+    store_folder = f"{len(Lf_dict)}Lf_change_Lc_{str(Lc_low).replace('.','u')}_{str(Lc_high).replace('.','u')}_Rf"
+    store = ResultStore(store_folder)
+    sweep = build_sweep(ns, journal=store_folder + ".jsonl")
+
     # 初始化进度条
     with Progress(*Progress.get_default_columns(),TimeElapsedColumn(),) as progress:
-        task = progress.add_task("[cyan]Processing...", total=len(Lf_dict)*(max_Cf_search_round+len(Lc_list)*max_Rf_search_round))
-
-        # 对多个不同型号的反馈电感进行试验
-        for Lf_name in Lf_dict:
-
-            # 相关数据的存储
-            Lf_data = {}
-            Lf_data['Lc_list'] = Lc_list
-            Lf_data['Cf_value'] = 0
-            Lf_data['optimal_Cf'] = False
-            # 增益相关数据存储
-            Lf_data['peak_value_ramp_list'] =[]
-            Lf_data['peak_value_rf_list'] =[]
-            Lf_data['optimal_Rf_list'] =[]
-            Lf_data['f_peak_ramp_list']     =[]
-            Lf_data['f_low_ramp_list']      =[]
-            Lf_data['f_high_ramp_list']     =[]
-            Lf_data['bandwidth_ramp_list']    =[]
-            Lf_data['ramp_valid_list']      =[]  # 存储相关数据是否有效
-            # 噪声相关数据存储
-            Lf_data['out_noise_at_sig_peak_list'] = []
-            # 是否自激数据存储
-            Lf_data['sim_stable_list'] = []
-
-            # 添加要include进去可能使用的反馈电感模型
-            ns.clear_include()
-            current_dir = os.path.dirname(os.path.abspath(__file__))
-            components_dir = os.path.join(current_dir, 'components')
-            ns.add_include(os.path.join(components_dir, Lf_name + '.cir'))
-            ns.add_include(os.path.join(components_dir, 'ada4817.cir'))
-            Lf_value = Lf_dict[Lf_name]          # 电感数值以uH为单位
-            # 设置用于寻找合适的电感和带宽的仿真类型
-            ns.clear_dot_command()
-            ns.add_dot_command("ac " + dot_distribution + " " + \
-                    str(sim_freq_low) + "Meg " + str(sim_freq_high) +"Meg") # 查找带宽和增益，进行ac仿真
-            
-            # 搜索获取最佳电容值之后固定电容值进行后续实验
-            print(f"for {Lf_name}，searching optimal Cf:")
-            Cf = 1/(np.pow((2*np.pi*20e6),2)*Lf_value*1e-6)*1e12 # 电容数值以pF为单位，一开始的搜索值取理论值
-            round_count = 0
-            optimal_Cf = False # 用于记录Cf的寻找是否找到了最优值
-            Cf_top = 0
-            Cf_btm = 0
-            peak_freq_top = 1e8
-            peak_freq_btm =0
-            while True:
-                round_count +=1
-                ns.clear_mod_comp()
-                # 更改反馈电感为特定模型
-                ns.add_mod_comp("xl1",Lf_name)
-                # 更改反馈电容的值为理论所需的电容值
-                Cf_str = np.format_float_positional(Cf,precision=2,unique=False) + 'p'
-                ns.add_mod_comp("c2",Cf_str)
-                # 更改补偿电阻
-                ns.add_mod_comp("l2",Lc_Cf_search_str) # 搜索Cf的时候固定Lc的值
-                # 更改划分找到的反馈电阻
-                Rf_str = np.format_float_positional(Rf_start,precision=2,unique=False) + 'k' # 电阻数值以kOhm为单位，保留两位小数，和下面求解Rf的过程保持一致；搜索Cf时使用Rf搜索开始值
-                ns.add_mod_comp("r2",Rf_str)
-
-                arrs,plots = ns.run()
-
-                ###############################
-                # 在划分搜索过程中取出以下数据：
-                # 增益峰值
-                ###############################
-                # 首先取出增益相关参数 #
-                freq = np.real(arrs[0]['frequency'])
-                vout = arrs[0]['v(out)']
-                iin = arrs[0]['i(v5)']
-                ramp = np.abs(vout)/np.abs(iin)
-                # 找到峰值
-                peak_freq_ramp = freq[np.argmax(ramp)]
-                print(f"At round {round_count}, Cf of {np.format_float_positional(Cf,precision=2,unique=False)} pF has a peak at {np.format_float_positional(peak_freq_ramp/1e6,precision=4)} MHz;")
-                # 更新一下进度条
-                progress.update(task, advance=1)
-
-                # 通过目前找到的大于目标频率的最小频率、小于目标频率的最大频率以及本次测试频率的关系来更改下一次测试的Cf值
-                # 存在两种情况：
-                # 1. 还未找到大于或小于目标频率的频率，使用固定方向的搜索，步长可以调整
-                #       - 一开始因为没有上下界，所以第一次搜索一定找到一个界，而后就往另一个方向搜索，必定频率也一个方向变化，这是由反馈电阻和频率的确定的负相关关系决定的，如果这个负相关因为特定原因不满足，那么这里的搜索可能无效
-                #       - 固定方向搜索的时候可以有搜索快慢，如果得到的频率结果已经很接近，就用小步长搜索上下界
-                # 2. 已经找到大于和小于目标频率的频率，那么通过在中间某个位置取新的Cf值，逐渐逼近
-                #       - 取值方法可以用二分法，也可以结合已知的频率关系按照比例取Cf
-                # 3. 如果找到了足够接近的上下界，就取其中的上界对应的电阻
-                delta_Cf = Cf/2 # 固定方向搜索步长与当前Cf成比例
-                if np.abs(peak_freq_ramp -target_peak_freq) < target_peak_freq / 100: # 在一开始就足够接近目标频率的时候让delta_Cf快速衰减
-                    delta_Cf = delta_Cf / 5 
-                elif np.abs(peak_freq_ramp -target_peak_freq) < target_peak_freq / 50:
-                    delta_Cf = delta_Cf / 2
-
-                if peak_freq_ramp >= target_peak_freq:
-                    peak_freq_top = peak_freq_ramp
-                    Cf_top = Cf
-                    if Cf_btm == 0:# 仅找到上界，使用固定大小搜索
-                        Cf = round(Cf + delta_Cf,2)
-                    else:          # 已经找到上下界，使用划分法搜索
-                        Cf = round(((target_peak_freq - peak_freq_btm)/(peak_freq_top-peak_freq_btm)*(Cf_top-Cf_btm)+Cf_btm)*2/3 + (Cf_top+Cf_btm)/2/3,2) # 保留两位小数，和写到spice网表中的保持一致
-                elif peak_freq_ramp < target_peak_freq:
-                    peak_freq_btm = peak_freq_ramp
-                    Cf_btm = Cf
-                    if Cf_top == 0:# 仅找到下界，使用固定大小搜索
-                        Cf = round(Cf - delta_Cf,2)
-                    else:          # 已经找到上下界，使用划分法搜索
-                        Cf = round(((target_peak_freq - peak_freq_btm)/(peak_freq_top-peak_freq_btm)*(Cf_top-Cf_btm)+Cf_btm)*2/3 + (Cf_top+Cf_btm)/2/3,2) # 保留两位小数，和写到spice网表中的保持一致
-
-                if peak_freq_top - target_peak_freq < target_peak_freq*peak_precision:
-                    Cf = Cf_top
-                    peak_freq_ramp = peak_freq_top
-                    print(f"Found optimal Cf of {np.format_float_positional(Cf,precision=2,unique=False)} pF with peak at {np.format_float_positional(peak_freq_ramp/1e6,precision=4)} MHz.")
-                    progress.update(task,advance = max_Cf_search_round - round_count)
-                    optimal_Cf = True
-                    break
-
-                # 对于Cf超过上下界的情况，直接退出
-                if Cf > maximum_Cf:
-                    Cf = Cf_top
-                    peak_freq_ramp = peak_freq_top
-                    progress.update(task,advance = max_Cf_search_round - round_count)
-                    print(f"At round {round_count} found Cf of {np.format_float_positional(Cf,precision=2,unique=False)} pF with peak at {np.format_float_positional(peak_freq_ramp/1e6,precision=4)} MHz.")
-                    break
-                elif Cf <= minimum_Cf:
-                    Cf = Cf_btm
-                    peak_freq_ramp = peak_freq_btm
-                    progress.update(task,advance = max_Cf_search_round - round_count)
-                    print(f"At round {round_count} found Cf of {np.format_float_positional(Cf,precision=2,unique=False)} pF with peak at {np.format_float_positional(peak_freq_ramp/1e6,precision=4)} MHz.")
-                    break
-
-                # 对于计算太多轮次的就不计算了
-                if round_count >= max_Cf_search_round:
-                    if Cf_top != 0:
-                        Cf = Cf_top
-                        peak_freq_ramp = peak_freq_top
-                    print(f"At round {round_count} found Cf of {np.format_float_positional(Cf,precision=2,unique=False)} pF with peak at {np.format_float_positional(peak_freq_ramp/1e6,precision=4)} MHz.")
-                    break
-            # 记录下找到的Cf数据
-            Lf_data['Cf_value'] = Cf
-            Lf_data['optimal_Cf'] = optimal_Cf
-
-
-            ##########################################################
-            # 开始改变补偿电感进行仿真
-            #
-            # 对于同一个反馈电感型号改变补偿电感Lc时，从上一个Lc搜索到的理想电阻值开始搜索会更加快，因此在Lc循环外进行Rf初始化比较理想
-            Rf=Rf_start
-            for Lc in Lc_list:
-                Lc_str = np.format_float_positional(Lc,precision=4,unique=False) + 'u' # 电感数值以uH为单位
-                print(f"for {Lf_name} with compensation L {Lc_str}:")
-
-                #############################################
-                # 使用划分法查找最接近1MHz带宽的反馈电阻大小
-                round_count = 0 # 用于记录轮数，可以将轮数太多算不到的提前停止
-                optimal_Rf = False # 用于记录Rf的寻找是否找到了最优值
-                Rf_top = 0
-                Rf_btm = 0
-                bandwidth_top = 1e7
-                bandwidth_btm =0
-                while True:
-                    round_count +=1
-                    # 设置用于寻找合适的电感和带宽的仿真类型
-                    ns.clear_dot_command()
-                    ns.add_dot_command("ac " + dot_distribution + " " + \
-                            str(sim_freq_low) + "Meg " + str(sim_freq_high) +"Meg") # 查找带宽和增益，进行ac仿真
-                    ns.clear_mod_comp()
-                    # 更改反馈电感为特定模型
-                    ns.add_mod_comp("xl1",Lf_name)
-                    # 更改反馈电容的值为理论所需的电容值
-                    ns.add_mod_comp("c2",Cf_str)
-                    # 更改补偿电阻
-                    ns.add_mod_comp("l2",Lc_str)
-                    # 更改划分找到的反馈电阻
-                    Rf_str = np.format_float_positional(Rf,precision=2,unique=False) + 'k' # 电阻数值以kOhm为单位，保留两位小数，和下面求解Rf的过程保持一致
-                    ns.add_mod_comp("r2",Rf_str)
-
-                    arrs,plots = ns.run()
-
-                    ###############################
-                    # 在划分过程中取出以下数据：
-                    # 1. 增益峰值、增益带宽、增益峰值位置
-                    ###############################
-
-                    # 首先取出增益相关参数 #
-                    freq = np.real(arrs[0]['frequency'])
-                    vout = arrs[0]['v(out)']
-                    iin = arrs[0]['i(v5)']
-
-                    ramp = np.abs(vout)/np.abs(iin)
-
-                    # 找到峰值
-                    peak_value_ramp = np.max(ramp)
-
-                    # 计算 -3 dB 对应的幅度（即 1/√2 的幅度）
-                    half_peak_value_ramp = peak_value_ramp / np.sqrt(2)
-
-                    # 查找降到 -3 dB 的频率
-                    # 使用 numpy 的 where 找到所有满足幅度条件的位置
-                    indices_above_half_peak_ramp = np.where(ramp >= half_peak_value_ramp)[0]
-
-                    ramp_valid = False # 用来表征找到的带宽是否是真实带宽而非仿真频率宽度不够导致的带宽的情况
-                    # 计算带宽 Δf，即找到最小和最大频率点
-                    if len(indices_above_half_peak_ramp) >= 2:
-                        f_low_ramp = freq[indices_above_half_peak_ramp[0]]
-                        f_high_ramp = freq[indices_above_half_peak_ramp[-1]]
-                        bandwidth_ramp = f_high_ramp - f_low_ramp
-                        # 通过判断-3db峰是否碰到边界来判断数据是否valid
-                        if indices_above_half_peak_ramp[0] > 5 and indices_above_half_peak_ramp[-1] < len(ramp) - 5:
-                            ramp_valid = True
-                    else:
-                        f_low_ramp = 0
-                        f_high_ramp = 0
-                        bandwidth_ramp = 0  # 如果没有找到符合条件的点，返回0
-
-                    print(f"At round {round_count}, rf of {np.format_float_positional(Rf,precision=2,unique=False)} kohm has a {np.format_float_positional(bandwidth_ramp/1e6,precision=4)} MHz bandwidth;")
-
-                    # 更新一下进度条
-                    progress.update(task, advance=1)
-
-                    # 通过目前找到的大于目标带宽的最小带宽、小于目标带宽的最大带宽以及本次测试带宽的关系来更改下一次测试的Rf值
-                    # 存在两种情况：
-                    # 1. 还未找到大于或小于目标带宽的带宽，使用固定方向的搜索，步长可以调整
-                    #       - 一开始因为没有上下界，所以第一次搜索一定找到一个界，而后就往另一个方向搜索，必定带宽也一个方向变化，这是由反馈电阻和带宽的确定的负相关关系决定的，如果这个负相关因为特定原因不满足，那么这里的搜索可能无效
-                    #       - 固定方向搜索的时候可以有搜索快慢，如果得到的带宽结果已经很接近，就用小步长搜索上下界
-                    # 2. 已经找到大于和小于目标带宽的带宽，那么通过在中间某个位置取新的Rf值，逐渐逼近
-                    #       - 取值方法可以用二分法，也可以结合已知的带宽关系按照比例取Rf
-                    # 3. 如果找到了足够接近的上下界，就取其中的上界对应的电阻
-                    delta_Rf = Rf/2 # 固定方向搜索步长与当前Rf成比例
-                    if np.abs(bandwidth_ramp -target_bandwidth) < target_bandwidth / 100: # 在一开始就足够接近目标带宽的时候让delta_Rf快速衰减
-                        delta_Rf = delta_Rf / 8 
-                    elif np.abs(bandwidth_ramp -target_bandwidth) < target_bandwidth / 50:
-                        delta_Rf = delta_Rf / 4
-
-                    if bandwidth_ramp >= target_bandwidth:
-                        bandwidth_top = bandwidth_ramp
-                        Rf_top = Rf
-                        if Rf_btm == 0:# 仅找到上界，使用固定大小搜索
-                            Rf = round(Rf + delta_Rf,2)
-                        else:          # 已经找到上下界，使用划分法搜索
-                            Rf = round(((target_bandwidth - bandwidth_btm)/(bandwidth_top-bandwidth_btm)*(Rf_top-Rf_btm)+Rf_btm)*2/3 + (Rf_top+Rf_btm)/2/3,2) # 保留两位小数，和写到spice网表中的保持一致
-                    elif bandwidth_ramp < target_bandwidth:
-                        bandwidth_btm = bandwidth_ramp
-                        Rf_btm = Rf
-                        if Rf_top == 0:# 仅找到下界，使用固定大小搜索
-                            Rf = round(Rf - delta_Rf,2)
-                        else:          # 已经找到上下界，使用划分法搜索
-                            Rf = round(((target_bandwidth - bandwidth_btm)/(bandwidth_top-bandwidth_btm)*(Rf_top-Rf_btm)+Rf_btm)*2/3 + (Rf_top+Rf_btm)/2/3,2) # 保留两位小数，和写到spice网表中的保持一致
-
-                    if bandwidth_top - target_bandwidth < target_bandwidth*bandwidth_precision:
-                        Rf = Rf_top
-                        bandwidth_ramp = bandwidth_top
-                        print(f"Found optimal rf of {np.format_float_positional(Rf,precision=2,unique=False)} kohm with {np.format_float_positional(bandwidth_ramp/1e6,precision=4)} MHz bandwidth and peak gain {np.format_float_positional(peak_value_ramp/1e3,precision=4,unique=False)} kohm.")
-                        progress.update(task,advance = max_Rf_search_round - round_count)
-                        optimal_Rf = True
-                        break
-
-                    # 对于Rf超过上下界的情况，直接退出
-                    if Rf > maximum_Rf:
-                        Rf = Rf_top
-                        bandwidth_ramp = bandwidth_top
-                        progress.update(task,advance = max_Rf_search_round - round_count)
-                        print(f"At round {round_count} found rf of {np.format_float_positional(Rf,precision=2,unique=False)} kohm with {np.format_float_positional(bandwidth_ramp/1e6,precision=4)} MHz bandwidth and peak gain {np.format_float_positional(peak_value_ramp/1e3,precision=4,unique=False)} kohm. Quit early with not optimal Rf.")
-                        break
-                    elif Rf <= minimum_Rf:
-                        Rf = Rf_btm
-                        bandwidth_ramp = bandwidth_btm
-                        progress.update(task,advance = max_Rf_search_round - round_count)
-                        print(f"At round {round_count} found rf of {np.format_float_positional(Rf,precision=2,unique=False)} kohm with {np.format_float_positional(bandwidth_ramp/1e6,precision=4)} MHz bandwidth and peak gain {np.format_float_positional(peak_value_ramp/1e3,precision=4,unique=False)} kohm. Quit early with not optimal Rf.")
-                        break
-
-                    # 对于计算太多轮次的就不计算了
-                    if round_count >= max_Rf_search_round:
-                        if Rf_top != 0:
-                            Rf = Rf_top
-                            bandwidth_ramp = bandwidth_top
-                        print(f"At round {round_count} found rf of {np.format_float_positional(Rf,precision=2,unique=False)} kohm with {np.format_float_positional(bandwidth_ramp/1e6,precision=4)} MHz bandwidth and peak gain {np.format_float_positional(peak_value_ramp/1e3,precision=4,unique=False)} kohm. Quit early with not optimal Rf.")
-                        break
-
-                # 找到带宽最接近1MHz后存储数据
-                Lf_data['peak_value_ramp_list'].append(peak_value_ramp)
-                Lf_data['peak_value_rf_list'].append(Rf)
-                Lf_data['optimal_Rf_list'].append(optimal_Rf)
-                Lf_data['f_peak_ramp_list'].append(freq[np.argmax(ramp)])
-                Lf_data['f_low_ramp_list'].append(f_low_ramp)
-                Lf_data['f_high_ramp_list'].append(f_high_ramp)
-                Lf_data['bandwidth_ramp_list'].append(bandwidth_ramp)
-                Lf_data['ramp_valid_list'].append(ramp_valid)
-
-                ###########################################
-                # 找到最佳电阻值之后，完成以下测试：
-                # 1. 噪声峰值、噪声峰值位置
-                # 2. 是否自激
-                # 需注意，由于ngspice本身的bug（ver44.2），
-                # 在ac仿真同时进行noise仿真会导致noise仿真
-                # 结果不可靠，因此此处分开仿真
-                ###########################################
-
-                # 设置用于寻找其他数据的仿真类型
-                ns.clear_dot_command()
-                ns.add_dot_command("tran 3n 3u") # 判断是否自激，进行tran仿真
-                ns.add_dot_command("noise v(out) i1 " + dot_distribution + " " + \
-                        str(sim_freq_low) + "Meg " + str(sim_freq_high) +"Meg") # 考察噪声性能，进行noise仿真
-
-                # 重新更改元件的值
-                ns.clear_mod_comp()
-                # 更改反馈电感为特定模型
-                ns.add_mod_comp("xl1",Lf_name)
-                # 更改反馈电容的值为理论所需的电容值
-                ns.add_mod_comp("c2",Cf_str)
-                # 更改补偿电阻
-                ns.add_mod_comp("l2",Lc_str)
-                # 更改反馈电阻为二分测试最后找到的电阻值Rf
-                Rf_str = np.format_float_positional(Rf,precision=2,unique=False) + 'k' # 电阻数值以kOhm为单位
-                ns.add_mod_comp("r2",Rf_str)
-
-                # 运行仿真
-                arrs,plots = ns.run()
-
-                # 取出噪声相关参数
-                freq = np.real(arrs[1]['frequency'])
-                out_noise_density = arrs[1]['onoise_spectrum']
-                # 找到信号峰值时对应的噪声值（根据避免ngspice bug之后的仿真实验，发现噪声不具有峰值特性，而呈现谷状特性）
-                Lf_data['out_noise_at_sig_peak_list'].append(out_noise_density[np.argmax(ramp)])
-                    
-                # 判断是否出现自激
-                vout_mag_max = np.max(np.abs(np.real(arrs[0]['v(out)'])))
-                # 通过tran仿真的最大vout是否大于1v来判断是否自激
-                if vout_mag_max > 1:
-                    Lf_data['sim_stable_list'].append(False)
-                    print(f"Warning! It is not stable.")
-                else:
-                    Lf_data['sim_stable_list'].append(True)
-                    print(f"It is stable.")
-
-            # 将单个反馈电感对应的数据存储到data中
-            data[Lf_name] = Lf_data
-
-        # 将data保存
-        with open(f"{len(Lf_dict)}Lf_change_Lc_{str(Lc_low).replace('.','u')}_{str(Lc_high).replace('.','u')}_Rf.pkl", 'wb') as f:
-            pickle.dump(data, f)
-
-def draw(file_name):
-    # 读取pkl文件中的data字典
-    with open(file_name, 'rb') as f:
-        data = pickle.load(f)
-
-    for Lf_name in data:
-        # 获取该电感的字典数据
-        Lf_data = data.get(Lf_name, None)
+        task = progress.add_task("[cyan]Processing...", total=len(sweep.points()))
+
+        def report(index, point, row):
+            print(f"for {point['xl1']} with Cf {np.format_float_positional(row['Cf'],precision=2,unique=False)} pF "
+                  f"and compensation L {np.format_float_positional(point['l2'],precision=4,unique=False)}u: "
+                  f"found {'optimal ' if row['Rf_converged'] else 'not optimal '}rf of "
+                  f"{np.format_float_positional(row['Rf'],precision=2,unique=False)} kohm with "
+                  f"{np.format_float_positional(row['bandwidth_ramp']/1e6,precision=4)} MHz bandwidth and peak gain "
+                  f"{np.format_float_positional(row['peak_value_ramp']/1e3,precision=4,unique=False)} kohm.")
+            if not row['sim_stable']:
+                print(f"Warning! It is not stable.")
+            progress.update(task, advance=1)
+
+        sweep.run(store=store, callback=report)
+    print("Rf prediction error:", sweep.tasks[1].surrogate.report())
+    for index, point, error in sweep.failures:
+        print(f"Failed: {point['xl1']} with compensation L "
+              f"{np.format_float_positional(point['l2'],precision=4,unique=False)}u ({error.kind})")
+
+def draw(store_folder):
+    # 打开sim写出的结果文件夹，各列按需映射，不需要读入全部数据
+    store = ResultStore(store_folder)
+    Lf_name_column = np.asarray(store['xl1'])
+
+    for Lf_name in dict.fromkeys(Lf_name_column):
+        # 取出该电感对应的行
+        rows = Lf_name_column == Lf_name
 
         # 提取所需的数据
-        Lc_list = Lf_data['Lc_list']
-        Cf_value = Lf_data['Cf_value']
-        optimal_Cf = Lf_data['optimal_Cf']
-        peak_value_ramp_list = Lf_data['peak_value_ramp_list']
-        peak_value_rf_list = Lf_data['peak_value_rf_list']
-        optimal_Rf_list = Lf_data['optimal_Rf_list']
-        f_peak_ramp_list = Lf_data['f_peak_ramp_list']
-        f_low_ramp_list = Lf_data['f_low_ramp_list']
-        f_high_ramp_list = Lf_data['f_high_ramp_list']
-        bandwidth_ramp_list = Lf_data['bandwidth_ramp_list']
-        ramp_valid_list = Lf_data['ramp_valid_list']
-        out_noise_at_sig_peak_list = Lf_data['out_noise_at_sig_peak_list']
-        sim_stable_list = Lf_data['sim_stable_list']
+        Lc_list = store['l2'][rows]
+        Cf_value = store['Cf'][rows][0]
+        optimal_Cf = store['Cf_converged'][rows][0]
+        peak_value_ramp_list = store['peak_value_ramp'][rows]
+        peak_value_rf_list = store['Rf'][rows]
+        optimal_Rf_list = store['Rf_converged'][rows]
+        f_peak_ramp_list = store['f_peak_ramp'][rows]
+        f_low_ramp_list = store['f_low_ramp'][rows]
+        f_high_ramp_list = store['f_high_ramp'][rows]
+        bandwidth_ramp_list = store['bandwidth_ramp'][rows]
+        ramp_valid_list = store['ramp_valid'][rows]
+        out_noise_at_sig_peak_list = store['out_noise_at_sig_peak'][rows]
+        sim_stable_list = store['sim_stable'][rows]
 
         # 创建一个新的图形窗口
         fig, axs = plt.subplots(3, 1, figsize=(10, 12))  # 2行1列子图，调整窗口大小
@@ -497,11 +270,29 @@ def draw(file_name):
         plt.tight_layout()  # 自动调整布局，防止图表重叠
         plt.show()
 
+def tolerance():
+    # 在设计点附近按元件容差抽样，每次ngspice调用运行一批样本，得到峰值频率和带宽的分布与良率
+    ns = NgSim("idealC_1812cs103_compensate_idealL.cir","ngspice_working_folder",verbose=False)
+    ns.model_library = ModelLibrary(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'components'))
+    for component, value in mc_point.items():
+        ns.add_mod_comp(component, value)
+    ns.add_dot_command("ac " + dot_distribution + " " + str(sim_freq_low) + "Meg " + str(sim_freq_high) + "Meg")
+    result = monte_carlo(ns, mc_distributions, mc_samples, seed=mc_seed)
+    # 每一行是一个样本，response_metrics对所有样本一起计算
+    metrics = response_metrics(*gain_ramp([result.stacks[0]]))
+    passed = ((np.abs(metrics['f_peak']/target_peak_freq - 1) <= mc_peak_tolerance)
+              & (np.abs(metrics['bandwidth']/target_bandwidth - 1) <= mc_bandwidth_tolerance))
+    for name in ('f_peak', 'bandwidth', 'peak_value'):
+        stats = summary_statistics(metrics[name])
+        print(f"{name}: mean {stats['mean']:.6g}, std {stats['std']:.4g}, p5 {stats['p5']:.6g}, p95 {stats['p95']:.6g}")
+    print(f"yield: {summary_statistics(passed)['mean']*100:.1f}% of {len(result)} samples (seed {mc_seed})")
+
 # 设置命令行参数解析
 def main():
     parser = argparse.ArgumentParser(description="Run different functions based on command line arguments.")
     parser.add_argument('-s', '--sim', action='store_true', help="Run the sim function")
-    parser.add_argument('-d', '--draw', type=str, help="Run the draw function with a file name")
+    parser.add_argument('-d', '--draw', type=str, help="Run the draw function with a result folder written by sim")
+    parser.add_argument('-m', '--monte-carlo', action='store_true', help="Run the tolerance (Monte Carlo) analysis")
 
     # 解析命令行参数
     args = parser.parse_args()
@@ -512,8 +303,10 @@ def main():
     elif args.draw:
         # 如果-d参数提供了文件名，传递给 draw 函数
         draw(args.draw)
+    elif args.monte_carlo:
+        tolerance()
     else:
-        print("No valid argument provided. Use -s for sim or -d <filename> for draw.")
+        print("No valid argument provided. Use -s for sim, -d <filename> for draw or -m for Monte Carlo.")
 
 # 启动程序
 if __name__ == "__main__":
@@ -0,0 +1,27 @@
+import os
+import sys
+
+import pytest
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# pyng是仓库根目录下的单个模块；bench/fake_ngspice.py也用来直接写出raw文件
+sys.path.insert(0, root)
+sys.path.insert(0, os.path.join(root, "bench"))
+
+fake_ngspice = os.path.join(root, "bench", "fake_ngspice.py")
+
+
+@pytest.fixture
+def fake_ns(tmp_path, monkeypatch):
+    # 用bench/fake_ngspice.py代替ngspice：写出FAKE_NGSPICE_*指定的合成raw文件，
+    # v(n0)、v(n1)乘以网表中R1的值
+    from pyng import NgSim
+    monkeypatch.setenv("FAKE_NGSPICE_KIND", "ac")
+    monkeypatch.setenv("FAKE_NGSPICE_POINTS", "100")
+    monkeypatch.setenv("FAKE_NGSPICE_SCALE", "r1")
+    netlist = tmp_path / "rc.cir"
+    netlist.write_text("* fake circuit\nV5 in 0 dc 0 ac 1\nR1 in n0 1000\nC1 n0 0 1n\n.end\n")
+    ns = NgSim(str(netlist), str(tmp_path / "work"), verbose=False)
+    ns.ngspice = fake_ngspice
+    ns.add_dot_command(".ac lin 100 1meg 100meg")
+    return ns
@@ -0,0 +1,144 @@
+/*
+ * Minimal stand-in for libngspice, built by tests/test_shared.py to test
+ * NgShared without installing ngspice. It implements the few exported
+ * functions NgShared uses. "run" creates one AC plot "ac1" with the
+ * vectors frequency, out = r1/(1 + j f/1Meg) and v5#branch, where r1 is
+ * the last field of the R1 line and the point count comes from ".ac lin N".
+ * "destroy all" overwrites the previous vectors with NaN (instead of
+ * freeing them) so that tests can see results that alias its memory.
+ * A circuit containing "FAILRUN" prints a timestep error on "run"; one
+ * containing "FAILLOAD" is rejected by ngSpice_Circ.
+ */
+#include <math.h>
+#include <stdbool.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <strings.h>
+
+typedef struct { double cx_real; double cx_imag; } ngcomplex_t;
+
+typedef struct {
+    char *v_name;
+    int v_type;
+    short v_flags;
+    double *v_realdata;
+    ngcomplex_t *v_compdata;
+    int v_length;
+} vector_info;
+
+typedef int (SendChar)(char *, int, void *);
+
+#define N_VECS 3
+static SendChar *send_char = NULL;
+static void *user_data = NULL;
+static char *names[N_VECS + 1] = {"frequency", "out", "v5#branch", NULL};
+static int types[N_VECS] = {2, 3, 4};
+static vector_info vecs[N_VECS];
+static bool have_plot = false;
+static int points = 10;
+static double r1 = 1.0;
+static bool fail_run = false;
+
+int ngSpice_Init(SendChar *printfcn, void *statfcn, void *ngexit, void *sdata,
+                 void *sinitdata, void *bgtrun, void *userData)
+{
+    send_char = printfcn;
+    user_data = userData;
+    return 0;
+}
+
+static void say(const char *text)
+{
+    if (send_char)
+        send_char((char *)text, 0, user_data);
+}
+
+int ngSpice_Circ(char **lines)
+{
+    points = 10;
+    r1 = 1.0;
+    fail_run = false;
+    for (int i = 0; lines[i] != NULL; i++) {
+        const char *line = lines[i];
+        if (strstr(line, "FAILLOAD")) {
+            say("stderr Error: could not parse circuit");
+            return 1;
+        }
+        if (strstr(line, "FAILRUN"))
+            fail_run = true;
+        if (strncasecmp(line, ".ac lin ", 8) == 0)
+            points = atoi(line + 8);
+        if (strncasecmp(line, "r1 ", 3) == 0) {
+            const char *last = strrchr(line, ' ');
+            r1 = strtod(last + 1, NULL);
+        }
+    }
+    return 0;
+}
+
+static void destroy(void)
+{
+    /* poison instead of free, so aliasing results read NaN */
+    for (int k = 0; k < N_VECS; k++)
+        for (int i = 0; i < vecs[k].v_length; i++)
+            vecs[k].v_compdata[i].cx_real = vecs[k].v_compdata[i].cx_imag = NAN;
+    have_plot = false;
+}
+
+static void run(void)
+{
+    if (fail_run) {
+        say("stderr Error: Timestep too small; time = 1e-09, timestep = 1e-21");
+        return;
+    }
+    for (int k = 0; k < N_VECS; k++) {
+        vecs[k].v_name = names[k];
+        vecs[k].v_type = types[k];
+        vecs[k].v_flags = 2; /* VF_COMPLEX */
+        vecs[k].v_realdata = NULL;
+        vecs[k].v_compdata = calloc(points, sizeof(ngcomplex_t));
+        vecs[k].v_length = points;
+    }
+    for (int i = 0; i < points; i++) {
+        double f = 1e6*(i + 1);
+        double denominator = 1 + (f/1e6)*(f/1e6);
+        vecs[0].v_compdata[i].cx_real = f;
+        vecs[1].v_compdata[i].cx_real = r1/denominator;
+        vecs[1].v_compdata[i].cx_imag = -r1*(f/1e6)/denominator;
+        vecs[2].v_compdata[i].cx_real = 1e-3;
+    }
+    have_plot = true;
+}
+
+int ngSpice_Command(char *command)
+{
+    if (strcmp(command, "destroy all") == 0)
+        destroy();
+    else if (strcmp(command, "run") == 0)
+        run();
+    return 0;
+}
+
+char **ngSpice_AllPlots(void)
+{
+    static char *with_plot[] = {"ac1", "const", NULL};
+    static char *without_plot[] = {"const", NULL};
+    return have_plot ? with_plot : without_plot;
+}
+
+char **ngSpice_AllVecs(char *plotname)
+{
+    static char *none[] = {NULL};
+    return strcmp(plotname, "ac1") == 0 && have_plot ? names : none;
+}
+
+vector_info *ngGet_Vec_Info(char *vecname)
+{
+    if (!have_plot || strncmp(vecname, "ac1.", 4) != 0)
+        return NULL;
+    for (int k = 0; k < N_VECS; k++)
+        if (strcmp(vecname + 4, names[k]) == 0)
+            return &vecs[k];
+    return NULL;
+}
@@ -0,0 +1,56 @@
+# run_adaptive_ac：粗网格加峰值和-3dB交点附近的密集窗口，结果应与完整的密集网格相同
+import numpy as np
+import pytest
+
+from pyng import response_metrics
+
+
+@pytest.fixture
+def bandpass(fake_ns, monkeypatch):
+    # 假ngspice按网表中的.ac lin N f1 f2写出中心频率20MHz、Q=5的带通响应
+    monkeypatch.delenv("FAKE_NGSPICE_POINTS")
+    monkeypatch.setenv("FAKE_NGSPICE_Q", "5")
+    fake_ns.clear_dot_command()
+    return fake_ns
+
+
+def metrics(arrs):
+    arr = arrs[0]
+    return response_metrics(np.real(arr['frequency']), np.abs(arr['v(n0)']))
+
+
+def test_adaptive_matches_dense_grid(bandpass):
+    start, stop, points = 1e6, 100e6, 10000
+    tol = (stop - start)/(points - 1)
+    bandpass.add_dot_command(f".ac lin {points} 1meg 100meg")
+    dense, _ = bandpass.run()
+    assert len(dense[0]) == points
+    bandpass.clear_dot_command()
+    arrs, plots = bandpass.run_adaptive_ac(start, stop, points=points, coarse=200)
+    freq = np.real(arrs[0]['frequency'])
+    # 远少于密集网格的点数，按频率排列；粗网格以外的点都在密集网格上
+    assert len(freq) < points/5
+    assert plots[0][b'no. points'] == str(len(freq)).encode()
+    assert np.all(np.diff(freq) > 0)
+    coarse = np.linspace(start, stop, 200)
+    dense_points = freq[~np.isclose(freq[:, None], coarse[None, :], rtol=0, atol=1).any(axis=1)]
+    assert len(dense_points) > 0
+    grid_index = (dense_points - start)/tol
+    np.testing.assert_allclose(grid_index, np.round(grid_index), atol=1e-6)
+    adaptive, full = metrics(arrs), metrics(dense)
+    assert adaptive['valid'] and full['valid']
+    for name in ('f_peak', 'f_low', 'f_high'):
+        assert abs(adaptive[name] - full[name]) <= tol, name
+    assert adaptive['peak_value'] == pytest.approx(full['peak_value'], rel=1e-6)
+    # 真实的-3dB交点
+    f0, q = 20e6, 5
+    assert adaptive['f_high'] - adaptive['f_low'] == pytest.approx(f0/q, rel=1e-3)
+
+
+def test_adaptive_replaces_existing_analyses(bandpass):
+    bandpass.add_dot_command(".ac lin 50 1meg 100meg")
+    arrs, plots = bandpass.run_adaptive_ac(1e6, 100e6, points=5000, coarse=100)
+    assert len(plots) == 1
+    assert metrics(arrs)['valid']
+    # 当前的仿真命令不变
+    assert bandpass.dot_command_list == [".ac lin 50 1meg 100meg"]
@@ -0,0 +1,99 @@
+# arun：取消时结束ngspice并删除临时文件夹，超时抛出NgTimeoutError，同时运行的进程数不超过max_processes
+import asyncio
+import glob
+import os
+import time
+
+import numpy as np
+import pytest
+
+from pyng import NgTimeoutError
+
+
+@pytest.fixture
+def spawned(monkeypatch):
+    # 记录arun启动的进程，以及启动时已有的临时文件夹数（每个文件夹对应一个占用信号量的任务）
+    record = {'processes': [], 'folders': []}
+    create = asyncio.create_subprocess_exec
+
+    async def create_subprocess_exec(*args, cwd=None, **kwargs):
+        record['folders'].append(len(glob.glob(os.path.join(os.path.dirname(cwd), "async_*"))))
+        process = await create(*args, cwd=cwd, **kwargs)
+        record['processes'].append(process)
+        return process
+
+    monkeypatch.setattr(asyncio, "create_subprocess_exec", create_subprocess_exec)
+    return record
+
+
+def scratch_folders(ns):
+    return glob.glob(os.path.join(ns.working_folder, "async_*"))
+
+
+def test_arun_result(fake_ns):
+    arrs, plots = asyncio.run(fake_ns.arun())
+    assert np.abs(arrs[0]['v(n0)'][0]) == pytest.approx(1000/abs(1 + 1j/20))
+    assert scratch_folders(fake_ns) == []
+
+
+def test_cancel_kills_ngspice(fake_ns, spawned, monkeypatch):
+    monkeypatch.setenv("FAKE_NGSPICE_SLEEP", "30")
+
+    async def cancel():
+        task = asyncio.create_task(fake_ns.arun())
+        while not spawned['processes']:
+            await asyncio.sleep(0.01)
+        assert len(scratch_folders(fake_ns)) == 1
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    start = time.perf_counter()
+    asyncio.run(cancel())
+    assert time.perf_counter() - start < 10
+    process, = spawned['processes']
+    assert process.returncode is not None and process.returncode < 0
+    with pytest.raises(ProcessLookupError):
+        os.kill(process.pid, 0)
+    assert scratch_folders(fake_ns) == []
+    assert fake_ns.timings[-1]['error'] == "CancelledError"
+
+
+def test_timeout(fake_ns, spawned, monkeypatch):
+    monkeypatch.setenv("FAKE_NGSPICE_SLEEP", "30")
+    fake_ns.timeout = 0.5
+    start = time.perf_counter()
+    with pytest.raises(NgTimeoutError, match="timed out after 0.5 s"):
+        asyncio.run(fake_ns.arun())
+    assert time.perf_counter() - start < 10
+    assert spawned['processes'][0].returncode < 0
+    assert scratch_folders(fake_ns) == []
+
+
+def test_semaphore_cap(fake_ns, spawned, monkeypatch):
+    monkeypatch.setenv("FAKE_NGSPICE_SLEEP", "0.3")
+    fake_ns.max_processes = 2
+    jobs = []
+    for value in range(1, 7):
+        fake_ns.add_mod_comp("r1", str(value))
+        jobs.append(fake_ns.snapshot())
+
+    async def run_all():
+        return await asyncio.gather(*(fake_ns.arun(job) for job in jobs))
+
+    results = asyncio.run(run_all())
+    assert len(spawned['processes']) == 6
+    # 启动每个进程时最多有两个任务占用信号量，且确实同时运行了两个
+    assert max(spawned['folders']) == 2
+    gains = [np.abs(arrs[0]['v(n0)'][0])*abs(1 + 1j/20) for arrs, plots in results]
+    np.testing.assert_allclose(gains, range(1, 7))
+    # 传入的信号量代替max_processes，多个NgSim可以共用
+    spawned['folders'].clear()
+    spawned['processes'].clear()
+
+    async def shared():
+        semaphore = asyncio.Semaphore(1)
+        return await asyncio.gather(*(fake_ns.arun(job, semaphore=semaphore) for job in jobs[:3]))
+
+    asyncio.run(shared())
+    assert spawned['folders'] == [1, 1, 1]
@@ -0,0 +1,88 @@
+# NgCache：命中和未命中计数、按最近使用时间淘汰、include文件内容变化时键改变
+import os
+import time
+
+import numpy as np
+import pytest
+
+from pyng import NgCache
+
+
+@pytest.fixture
+def cached_ns(fake_ns, tmp_path):
+    fake_ns.cache = NgCache(str(tmp_path / "cache"))
+    return fake_ns
+
+
+def test_hits_and_misses(cached_ns, monkeypatch):
+    arrs, plots = cached_ns.run()
+    assert cached_ns.cache.stats() == {'hits': 0, 'misses': 1}
+    # 命中时不运行ngspice
+    monkeypatch.setenv("FAKE_NGSPICE_FAIL", "Timestep too small")
+    cached_arrs, cached_plots = cached_ns.run()
+    assert cached_ns.cache.stats() == {'hits': 1, 'misses': 1}
+    np.testing.assert_array_equal(cached_arrs[0], arrs[0])
+    assert [stats.get('cached', False) for stats in cached_ns.timings] == [False, True]
+    # run_many的任务在其他文件夹中运行，键相同
+    assert cached_ns.run_many([cached_ns.snapshot()]*2, max_workers=2)[0] is not None
+    assert cached_ns.cache.stats() == {'hits': 3, 'misses': 1}
+    monkeypatch.delenv("FAKE_NGSPICE_FAIL")
+    cached_ns.add_mod_comp("r1", "2k")
+    cached_ns.run()
+    assert cached_ns.cache.stats() == {'hits': 3, 'misses': 2}
+
+
+def test_lru_eviction(cached_ns):
+    def run(value):
+        cached_ns.add_mod_comp("r1", value)
+        cached_ns.run()
+        time.sleep(0.05) # 使各文件的使用时间不同
+
+    cache = cached_ns.cache
+    run("1k")
+    size = os.path.getsize(os.path.join(cached_ns.working_folder, "out.raw"))
+    cache.max_bytes = int(size*2.5)
+    run("2k")
+    run("1k")   # 命中，1k比2k更近使用
+    run("3k")   # 超过max_bytes，淘汰最久未使用的2k
+    assert cache.stats() == {'hits': 1, 'misses': 3}
+    assert len([name for name in os.listdir(cache.folder) if name.endswith(".raw")]) == 2
+    run("1k")
+    run("3k")
+    assert cache.stats() == {'hits': 3, 'misses': 3}
+    run("2k")
+    assert cache.stats() == {'hits': 3, 'misses': 4}
+    assert sum(entry.stat().st_size for entry in os.scandir(cache.folder)) <= cache.max_bytes
+
+
+def test_key_follows_included_files(cached_ns):
+    work = cached_ns.working_folder
+    os.makedirs(work)
+    with open(os.path.join(work, "outer.lib"), 'w') as f:
+        f.write('* outer\n.include "inner.lib"\n')
+    inner = os.path.join(work, "inner.lib")
+    with open(inner, 'w') as f:
+        f.write(".model d1 d is=1e-14\n")
+    cached_ns.add_include("outer.lib")
+    cache = cached_ns.cache
+    job = cached_ns.snapshot()
+    key = cache.key(cached_ns, job)
+    assert cache.key(cached_ns, cached_ns.snapshot()) == key
+    # 嵌套include的文件内容变化时键改变，恢复后键也恢复
+    with open(inner, 'w') as f:
+        f.write(".model d1 d is=2e-14\n")
+    changed = cache.key(cached_ns, job)
+    assert changed != key
+    cached_ns.run()
+    with open(inner, 'w') as f:
+        f.write(".model d1 d is=1e-14\n")
+    assert cache.key(cached_ns, job) == key
+    cached_ns.run()
+    assert cache.stats() == {'hits': 0, 'misses': 2}
+    # 兼容类型和ngspice版本也是键的一部分
+    cached_ns.compat_type = "hs"
+    assert cache.key(cached_ns, job) not in (key, changed)
+    cached_ns.compat_type = "ltpsa"
+    assert "fake ngspice" in cached_ns.ngspice_version()
+    cached_ns._ngspice_version = "ngspice-43"
+    assert cache.key(cached_ns, job) not in (key, changed)
@@ -0,0 +1,57 @@
+# Sweep：重复的搜索只运行一次，中断后从journal继续
+import json
+
+import numpy as np
+import pytest
+
+from pyng import ResultStore, Sweep, SweepCheck, SweepTask
+
+
+def gain(arrs, plots):
+    return np.abs(arrs[0]['v(n0)'][0])
+
+
+def build_sweep(ns, journal):
+    # 对每个C1寻找使增益为2000的R1，再验证一次n1的增益
+    task = SweepTask("rf", "r1", gain, 2000*abs(1/(1 + 1j/20)), bounds=(100, 1e5), tol=0.5, precision=0)
+    check = SweepCheck("gain_n1", [".ac lin 100 1meg 100meg"],
+                       lambda arrs, plots, row: {'gain_n1': np.abs(arrs[0]['v(n1)'][0])})
+    return Sweep(ns, axes={'c1': ["1n", "2n", "3n"]}, dot_commands=[".ac lin 100 1meg 100meg"],
+                 tasks=[task], checks=[check], journal=journal)
+
+
+def test_sweep_resumes_from_journal(fake_ns, tmp_path, monkeypatch):
+    journal = str(tmp_path / "sweep.jsonl")
+    runs = []
+    run = fake_ns.run
+    monkeypatch.setattr(fake_ns, "run", lambda: runs.append(1) or run())
+
+    def interrupt(index, point, row):
+        if index == 1:
+            raise KeyboardInterrupt
+
+    with pytest.raises(KeyboardInterrupt):
+        build_sweep(fake_ns, journal).run(callback=interrupt)
+    first_runs = len(runs)
+    # 中断时写了一半的最后一行
+    with open(journal, 'a') as f:
+        f.write('{"key": "')
+    runs.clear()
+    store = ResultStore(str(tmp_path / "store"))
+    rows = build_sweep(fake_ns, journal).run(store=store)
+    assert [row['c1'] for row in rows] == ["1n", "2n", "3n"]
+    assert all(row['rf'] == 2000 and row['rf_converged'] for row in rows)
+    # 只运行了第三个点：搜索从上一个点的结果开始，一次命中，再加一次验证
+    assert len(runs) == 2 < first_runs
+    assert len(store) == 1 and store['c1'][0] == "3n"
+    runs.clear()
+    assert build_sweep(fake_ns, journal).run() == rows
+    assert runs == []
+
+
+def test_sweep_journal_lines_are_json(fake_ns, tmp_path):
+    journal = tmp_path / "sweep.jsonl"
+    build_sweep(fake_ns, str(journal)).run()
+    entries = [json.loads(line) for line in journal.read_text().splitlines()]
+    # 每个点有一个搜索、一个验证和一个点的记录
+    assert len(entries) == 9
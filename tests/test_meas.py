@@ -0,0 +1,58 @@
+# parse_meas/run_meas：从ngspice批处理模式的标准输出中读取.meas的结果
+import math
+import os
+
+import numpy as np
+import pytest
+
+from pyng import parse_meas
+
+STDOUT = """
+Circuit: * rc filter
+
+Doing analysis at TEMP = 27.000000 and TNOM = 27.000000
+
+No. of Data Rows : 100
+PEAK                =  9.987523e+02 at=  1.000000e+06
+valley = 4.472136e+01 at = 1.000000e+08
+f_low               =  1.503000e+06
+Error: measure  bw  (WHEN) : out of interval
+bw                  =  failed
+other               =  1.000000e+00
+
+Total analysis time (seconds) = 0.002
+"""
+
+
+def test_parse_meas():
+    results = parse_meas(STDOUT, ["peak", "valley", "F_LOW", "bw", "missing"])
+    assert results['peak'] == 998.7523 and results['peak_at'] == 1e6
+    assert results['valley'] == 44.72136 and results['valley_at'] == 1e8
+    assert results['f_low'] == 1.503e6 and 'f_low_at' not in results
+    # 失败和没有输出的测量为nan，没有位置
+    assert math.isnan(results['bw']) and 'bw_at' not in results
+    assert math.isnan(results['missing'])
+    # 只返回请求的名称
+    assert set(results) == {'peak', 'peak_at', 'valley', 'valley_at', 'f_low', 'bw', 'missing'}
+    assert parse_meas("", []) == {}
+
+
+def test_run_meas(fake_ns):
+    fake_ns.add_meas("AC", "Peak", "max vm(n0)")
+    fake_ns.add_meas("ac", "low", "min vm(n1)")
+    fake_ns.add_meas("ac", "f_cut", "when vm(n0)=500 fall=1")
+    assert fake_ns.meas_list[0] == ".meas ac peak max vm(n0)"
+    results = fake_ns.run_meas()
+    # v(n0) = R1/(1 + jf/20MHz)，v(n1) = R1/(1 + jf/40MHz)，频率1MHz到100MHz
+    assert results['peak'] == pytest.approx(1000/abs(1 + 1j/20), rel=1e-6)
+    assert results['peak_at'] == pytest.approx(1e6)
+    assert results['low'] == pytest.approx(1000/abs(1 + 2.5j), rel=1e-6)
+    assert results['low_at'] == pytest.approx(100e6)
+    assert np.isnan(results['f_cut'])
+    # 不写raw文件，.meas语句不加入run()
+    assert not os.path.exists(os.path.join(fake_ns.working_folder, "out.raw"))
+    assert not any(line.startswith(".meas") for line in fake_ns.render_netlist())
+    fake_ns.add_mod_comp("r1", "2k")
+    assert fake_ns.run_meas()['peak'] == pytest.approx(2*results['peak'], rel=1e-6)
+    fake_ns.clear_meas()
+    assert fake_ns.run_meas() == {}
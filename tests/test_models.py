@@ -0,0 +1,43 @@
+# ModelLibrary：按网表引用的子电路生成模型文件
+import os
+
+from pyng import ModelLibrary, NgSim
+
+
+def write_models(folder):
+    folder.mkdir()
+    (folder / "inductors.lib").write_text(
+        ".model rcore r\n"
+        ".subckt l1u a b\nL1 a m 1u\nxr m b rser\n.ends\n"
+        ".subckt l2u a b\nL1 a b 2u\n.ends\n")
+    (folder / "parts.lib").write_text(".subckt rser a b\nR1 a b 0.1\n.ends\n")
+
+
+def test_snapshot_includes_referenced_models(tmp_path, monkeypatch):
+    write_models(tmp_path / "components")
+    netlist = tmp_path / "lc.cir"
+    netlist.write_text("* lc\nV1 in 0 ac 1\nxl1 in out l1u\nC1 out 0 1n\n.end\n")
+    ns = NgSim(str(netlist), str(tmp_path / "work"), verbose=False)
+    ns.model_library = ModelLibrary(str(tmp_path / "components"), str(tmp_path / "models"))
+    renders = []
+    render = ns.netlist.render
+    monkeypatch.setattr(ns.netlist, "render", lambda *args: renders.append(1) or render(*args))
+    job = ns.snapshot()
+    model_file = job.include_list[-1].split('"')[1]
+    assert os.path.dirname(model_file) == str(tmp_path / "models")
+    text = open(model_file).read()
+    assert ".subckt l1u" in text and ".subckt rser" in text and ".model rcore" in text
+    assert ".subckt l2u" not in text
+    # 只修改元件值时不再生成和扫描网表
+    ns.add_mod_comp("c1", "2n")
+    assert ns.snapshot().include_list == job.include_list
+    assert len(renders) == 1
+    ns.add_mod_comp("xl1", "in out l2u")
+    assert ".subckt l2u" in open(ns.snapshot().include_list[-1].split('"')[1]).read()
+    assert len(renders) == 2
+    assert sorted(os.listdir(tmp_path / "components")) == ["inductors.lib", "parts.lib"]
+
+
+def test_default_cache_folder_is_outside_the_library(tmp_path):
+    library = ModelLibrary(str(tmp_path))
+    assert not library.cache_folder.startswith(str(tmp_path))
@@ -0,0 +1,60 @@
+# monte_carlo：假ngspice执行控制块中的alter/分析/write，v(n0)乘以R1被alter后的值
+import numpy as np
+import pytest
+
+from pyng import monte_carlo, summary_statistics
+
+
+def lowpass(r1, freq):
+    return r1/(1 + 1j*freq/20e6)
+
+
+def test_same_seed_any_batch_size(fake_ns):
+    distributions = {'r1': ('normal', 1000, 0.05)}
+    results = [monte_carlo(fake_ns, distributions, n=7, seed=3, batch_size=batch_size, max_workers=2)
+               for batch_size in (7, 3, 1)]
+    first = results[0]
+    assert len(first) == 7
+    assert first.stacks[0].shape == (7, 100)
+    for result in results[1:]:
+        np.testing.assert_array_equal(result.samples['r1'], first.samples['r1'])
+        assert len(result.stacks) == len(first.stacks) == 1
+        np.testing.assert_array_equal(result.stacks[0], first.stacks[0])
+    # 第i行是第i个样本的结果（alter写出9位有效数字）
+    stack = first.stacks[0]
+    expected = lowpass(first.samples['r1'][:, None], stack['frequency'].real)
+    np.testing.assert_allclose(stack['v(n0)'], expected, rtol=1e-8)
+    assert first.plots[0][b'plotname'] == b"AC Analysis"
+    # 不同的seed得到不同的样本
+    other = monte_carlo(fake_ns, distributions, n=7, seed=4, batch_size=3, max_workers=2)
+    assert not np.array_equal(other.samples['r1'], first.samples['r1'])
+
+
+def test_batch_without_raw_file(fake_ns):
+    # 没有分析时控制块不写出raw文件
+    with pytest.raises(ValueError, match="did not write a raw file"):
+        monte_carlo(fake_ns, {'r1': ('uniform', 1000, 0.1)}, n=2, seed=1, analyses=[], max_workers=1)
+
+
+def test_summary_statistics():
+    values = np.array([[1.0, 10.0], [2.0, np.nan], [3.0, 30.0], [4.0, 40.0]])
+    stats = summary_statistics(values, percentiles=(50, 75))
+    np.testing.assert_allclose(stats['mean'], [2.5, 80/3])
+    np.testing.assert_allclose(stats['std'], [np.std([1, 2, 3, 4]), np.std([10, 30, 40])])
+    np.testing.assert_array_equal(stats['min'], [1, 10])
+    np.testing.assert_array_equal(stats['max'], [4, 40])
+    np.testing.assert_allclose(stats['p50'], [2.5, 30])
+    np.testing.assert_allclose(stats['p75'], [3.25, 35])
+    assert set(stats) == {'mean', 'std', 'min', 'max', 'p50', 'p75'}
+    # 通过/不通过数组的均值为良率
+    assert summary_statistics(np.array([True, False, True, True]))['mean'] == 0.75
+
+
+def test_result_summary(fake_ns):
+    result = monte_carlo(fake_ns, {'r1': ('uniform', 1000, 0.1)}, n=20, seed=2, max_workers=2)
+    stats = result.summary('v(n0)', percentiles=(5,))
+    magnitude = np.abs(result.stacks[0]['v(n0)'])
+    np.testing.assert_allclose(stats['mean'], magnitude.mean(axis=0))
+    np.testing.assert_allclose(stats['p5'], np.percentile(magnitude, 5, axis=0))
+    assert stats['mean'].shape == (100,)
+    assert 900 <= result.samples['r1'].min() and result.samples['r1'].max() <= 1100
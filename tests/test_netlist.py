@@ -0,0 +1,84 @@
+# NgNetlist：标题行、续行合并、按字段修改元件，以及设置未变时不重写网表
+import os
+
+import pytest
+
+from pyng import NgSim
+
+
+NETLIST = """* amplifier test
+.include "models.lib"
+V5 in 0 dc 0 ac 1
+X1 in out amp gain=10 bw = 5meg
++ k=4.98e-3
+R1 out 0 1k
+.end
+"""
+
+
+@pytest.fixture
+def ns(tmp_path):
+    netlist = tmp_path / "amp.cir"
+    netlist.write_text(NETLIST)
+    return NgSim(str(netlist), str(tmp_path / "work"), verbose=False)
+
+
+def test_title_kept(ns, tmp_path):
+    ns.add_include("other.lib")
+    ns.add_dot_command(".ac lin 10 1 10")
+    lines = ns.render_netlist()
+    # 第一行原样保留为标题，include和仿真命令插入在第一个元件之前
+    assert lines[0] == "* amplifier test\n"
+    assert lines[1] == '.include "models.lib"\n'
+    assert lines[2:5] == ['.include "other.lib"\n', ".ac lin 10 1 10\n", "V5 in 0 dc 0 ac 1\n"]
+    # 不以*开头的标题也不会被当作元件
+    netlist = tmp_path / "plain.cir"
+    netlist.write_text("RC filter\nR1 in out 1k\nC1 out 0 1n\n.end\n")
+    plain = NgSim(str(netlist), str(tmp_path / "work"), verbose=False)
+    assert "rc" not in plain.netlist.index
+    plain.add_dot_command(".op")
+    assert plain.render_netlist()[:3] == ["RC filter\n", ".op\n", "R1 in out 1k\n"]
+
+
+def test_continuation_merged(ns):
+    assert ns.netlist.lines[ns.netlist.index["x1"]] == "X1 in out amp gain=10 bw = 5meg k=4.98e-3"
+    ns.add_mod_comp("x1", "k=5e-3")
+    lines = ns.render_netlist()
+    assert "X1 in out amp gain=10 bw = 5meg k=5e-3\n" in lines
+    assert not any(line.startswith("+") for line in lines)
+
+
+def test_field_edits(ns):
+    ns.add_mod_comp("V5", "2", field="AC")
+    ns.add_mod_comp("x1", "20", field="gain")
+    ns.add_mod_comp("x1", "6meg", field="bw")
+    ns.add_mod_comp("x1", "5e-3", field="k")
+    ns.add_mod_comp("x1", "amp2", field=3)
+    lines = ns.render_netlist()
+    assert "V5 in 0 dc 0 ac 2\n" in lines
+    assert "X1 in out amp2 gain=20 bw = 6meg k=5e-3\n" in lines
+    # 按字段修改之后再替换最后一个字段
+    ns.add_mod_comp("r1", "2k")
+    ns.add_mod_comp("r1", "r0", field=2)
+    assert "R1 out r0 2k\n" in ns.render_netlist()
+    ns.add_mod_comp("r1", "1", field="tc")
+    with pytest.raises(ValueError, match="no field tc"):
+        ns.render_netlist()
+
+
+def test_unchanged_netlist_not_rewritten(ns):
+    ns.setup_working_dir()
+    netlist_file = os.path.join(ns.working_folder, "amp.cir")
+    with open(netlist_file, 'w') as f:
+        f.write("marker\n")
+    ns.setup_working_dir()
+    with open(netlist_file) as f:
+        assert f.read() == "marker\n"
+    # 设置改变或文件被删除时重写
+    ns.add_mod_comp("r1", "2k")
+    ns.setup_working_dir()
+    with open(netlist_file) as f:
+        assert "R1 out 0 2k\n" in f.read()
+    os.remove(netlist_file)
+    ns.setup_working_dir()
+    assert os.path.exists(netlist_file)
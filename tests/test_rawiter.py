@@ -0,0 +1,66 @@
+# rawiter按块读取raw文件，以及ASCII raw文件：完整的和写了一半（ngspice被中断）的文件
+import numpy as np
+from fake_ngspice import synthetic_plots, write_raw
+
+from pyng import rawiter, rawread_ascii
+
+
+def ascii_plot(plot, arr):
+    # 与ngspice的ASCII raw文件格式相同：每个点先写"序号<TAB>值"，其余向量每行一个"<TAB>值"
+    complex_data = arr.dtype[0] == np.complex128
+    lines = ["Title: fake ngspice", "Date: Thu Jan  1 00:00:00  1970",
+             f"Plotname: {plot}", f"Flags: {'complex' if complex_data else 'real'}",
+             f"No. Variables: {len(arr.dtype.names)}", f"No. Points: {len(arr)}", "Variables:"]
+    lines += [f"\t{i}\t{name}\tvoltage" for i, name in enumerate(arr.dtype.names)]
+    lines.append("Values:")
+    for i, row in enumerate(arr):
+        for j, value in enumerate(row):
+            text = f"{float(value.real)!r},{float(value.imag)!r}" if complex_data else repr(float(value))
+            lines.append(f" {i}\t{text}" if j == 0 else f"\t{text}")
+    return ("\n".join(lines) + "\n").encode()
+
+
+def test_rawiter_blocks(fake_ns, tmp_path):
+    fname = str(tmp_path / "out.raw")
+    write_raw(fname, "noise", points=50, n_plots=2)
+    arrs, plots = fake_ns.rawread(fname)
+    blocks = list(rawiter(fname, chunk_rows=20))
+    assert [(index, len(block)) for index, _, block in blocks] == [
+        (0, 20), (0, 20), (0, 10), (1, 1), (2, 20), (2, 20), (2, 10), (3, 1)]
+    np.testing.assert_array_equal(np.concatenate([block for index, _, block in blocks if index == 2]), arrs[2])
+
+
+def test_ascii_matches_binary(fake_ns, tmp_path):
+    binary = str(tmp_path / "binary.raw")
+    write_raw(binary, "ac", points=30, n_vars=2)
+    arrs, plots = fake_ns.rawread(binary)
+    ascii = tmp_path / "ascii.raw"
+    ascii.write_bytes(ascii_plot("AC Analysis", arrs[0]) + ascii_plot("AC Analysis", arrs[0][:5]))
+    ascii_arrs, ascii_plots = fake_ns.rawread(str(ascii))
+    assert ascii_arrs[0].dtype == arrs[0].dtype
+    np.testing.assert_array_equal(ascii_arrs[0], arrs[0])
+    np.testing.assert_array_equal(ascii_arrs[1], arrs[0][:5])
+    assert [len(block) for _, _, block in rawiter(str(ascii), chunk_rows=16)] == [16, 14, 5]
+    np.testing.assert_array_equal(rawread_ascii(str(ascii))[0][0], arrs[0])
+
+
+def test_truncated_binary(fake_ns, tmp_path):
+    plot = synthetic_plots("tran", points=100, n_vars=1)[0]
+    head = plot.index(b"Binary:\n") + len(b"Binary:\n")
+    row = (len(plot) - head)//100
+    fname = tmp_path / "out.raw"
+    # 第一个plot写了30.5行时ngspice被中断
+    fname.write_bytes(plot[:head + 30*row + row//2])
+    assert [len(block) for _, _, block in rawiter(str(fname), chunk_rows=20)] == [20, 10]
+
+
+def test_truncated_ascii(fake_ns, tmp_path):
+    arr = np.frombuffer(synthetic_plots("tran", points=10, n_vars=1)[0].split(b"Binary:\n", 1)[1],
+                        dtype=[('time', np.float64), ('v(n0)', np.float64)])
+    text = ascii_plot("Transient Analysis", arr)
+    fname = tmp_path / "out.raw"
+    # 最后一个点只写出了时间
+    fname.write_bytes(text[:text.rindex(b"\t")])
+    arrs, plots = fake_ns.rawread(str(fname))
+    assert len(arrs[0]) == 9
+    np.testing.assert_array_equal(arrs[0], arr[:9])
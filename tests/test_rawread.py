@@ -0,0 +1,67 @@
+# rawread：一次扫描头部索引所有plot，每个plot是同一个缓冲区的视图
+import resource
+
+import numpy as np
+import pytest
+from fake_ngspice import synthetic_plots, write_raw
+
+import pyng
+
+
+def test_binary_plots(fake_ns, tmp_path):
+    fname = str(tmp_path / "out.raw")
+    write_raw(fname, "noise", points=50, n_plots=2)
+    arrs, plots = fake_ns.rawread(fname)
+    assert [plot[b'plotname'] for plot in plots] == [b'Noise Spectral Density Curves', b'Integrated Noise']*2
+    assert [plot['varnames'] for plot in plots[:2]] == [['frequency', 'onoise_spectrum'], ['onoise_total']]
+    assert [len(arr) for arr in arrs] == [50, 1, 50, 1]
+    np.testing.assert_array_equal(arrs[0], arrs[2])
+    # 结果可以修改，不影响文件
+    arrs[0]['frequency'][0] = -1
+    assert fake_ns.rawread(fname)[0][0]['frequency'][0] == 1e6
+
+
+def test_truncated_binary(fake_ns, tmp_path):
+    plot = synthetic_plots("tran", points=100, n_vars=1)[0]
+    head = plot.index(b"Binary:\n") + len(b"Binary:\n")
+    row = (len(plot) - head)//100
+    fname = tmp_path / "out.raw"
+    # 第一个plot写了30.5行时ngspice被中断
+    fname.write_bytes(plot[:head + 30*row + row//2])
+    arrs, plots = fake_ns.rawread(str(fname))
+    assert len(arrs) == 1 and len(arrs[0]) == 30
+
+
+def test_empty_file(fake_ns, tmp_path):
+    fname = tmp_path / "out.raw"
+    fname.write_bytes(b"")
+    assert fake_ns.rawread(str(fname)) == ([], [])
+
+
+def test_large_files_are_mapped(fake_ns, tmp_path, monkeypatch):
+    fname = str(tmp_path / "out.raw")
+    write_raw(fname, "ac", points=100)
+    eager, _ = fake_ns.rawread(fname)
+    monkeypatch.setattr(pyng, "MMAP_MIN_BYTES", 0)
+    mapped, _ = fake_ns.rawread(fname)
+    np.testing.assert_array_equal(mapped[0], eager[0])
+    mapped[0]['v(n0)'][0] = 0
+    assert fake_ns.rawread(fname)[0][0]['v(n0)'][0] == eager[0]['v(n0)'][0]
+
+
+@pytest.fixture
+def fd_limit():
+    # 与常见的默认值相同，限制为1024个文件描述符
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (min(1024, hard), hard))
+    yield
+    resource.setrlimit(resource.RLIMIT_NOFILE, (soft, hard))
+
+
+def test_results_do_not_hold_file_descriptors(fake_ns, tmp_path, fd_limit):
+    fname = str(tmp_path / "out.raw")
+    write_raw(fname, "ac", points=10)
+    results = [fake_ns.rawread(fname) for _ in range(1100)]
+    assert len(results) == 1100
+    # 保留所有结果时仍然可以打开文件
+    open(fname, 'rb').close()
@@ -0,0 +1,60 @@
+# response_metrics对多条曲线一次计算的结果应与逐条计算相同
+import numpy as np
+import pytest
+
+from pyng import response_metrics, response_peak, stack_runs
+
+
+def second_order(freq, f0, q):
+    s = 1j*freq/f0
+    return np.abs(1/(s**2 + s/q + 1))
+
+
+freq = np.linspace(1e6, 100e6, 2000)
+f0s = np.array([15e6, 20e6, 25e6, 30e6])
+qs = np.array([0.9, 1.5, 3.0, 5.0])
+
+
+def test_batched_matches_single_traces():
+    mag = np.array([[second_order(freq, f0, q) for f0 in f0s] for q in qs])
+    batched = response_metrics(freq, mag)
+    assert batched['f_peak'].shape == (len(qs), len(f0s))
+    for i in range(len(qs)):
+        for j in range(len(f0s)):
+            single = response_metrics(freq, mag[i, j])
+            for name, value in single.items():
+                assert batched[name][i, j] == value, name
+
+
+def test_peak_and_bandwidth():
+    q = qs[-1]
+    mag = np.array([second_order(freq, f0, q) for f0 in f0s])
+    metrics = response_metrics(freq, mag)
+    # 二阶低通的峰值频率为f0*sqrt(1 - 1/(2q^2))，峰值为q/sqrt(1 - 1/(4q^2))
+    np.testing.assert_allclose(metrics['f_peak'], f0s*np.sqrt(1 - 1/(2*q**2)), rtol=1e-4)
+    np.testing.assert_allclose(metrics['peak_value'], q/np.sqrt(1 - 1/(4*q**2)), rtol=1e-5)
+    fine = np.linspace(1e6, 100e6, 200000)
+    for j, f0 in enumerate(f0s):
+        above = fine[second_order(fine, f0, q) >= metrics['peak_value'][j]/np.sqrt(2)]
+        assert metrics['f_low'][j] == pytest.approx(above[0], rel=1e-3)
+        assert metrics['f_high'][j] == pytest.approx(above[-1], rel=1e-3)
+    assert np.all(metrics['valid'])
+
+
+def test_edges_and_nan_padding():
+    # 低通曲线从第一个点就高于-3dB，不是有效的带通结果
+    mag = second_order(freq, 20e6, 0.5)
+    metrics = response_metrics(freq, mag)
+    assert metrics['low_edge'] and not metrics['valid']
+    # stack_runs用NaN补齐点数较少的运行，NaN点被忽略
+    dtype = [('frequency', np.float64), ('v(out)', np.float64)]
+    runs = []
+    for n in (2000, 1500):
+        run = np.empty(n, dtype=dtype)
+        run['frequency'] = freq[:n]
+        run['v(out)'] = second_order(freq[:n], 20e6, 3.0)
+        runs.append(run)
+    stacks, _ = stack_runs(runs, [{}, {}], 2)
+    padded = response_metrics(stacks[0]['frequency'], stacks[0]['v(out)'])
+    assert padded['f_peak'][1] == response_metrics(freq[:1500], runs[1]['v(out)'])['f_peak']
+    assert response_peak(freq, stacks[0]['v(out)'])[1][0] == padded['f_peak'][0]
@@ -0,0 +1,35 @@
+# ResultStore：按列存储、只追加，写了一半的行在读取和追加时被忽略
+import numpy as np
+import pytest
+
+from pyng import ResultStore
+
+
+def test_result_store_round_trip(tmp_path):
+    store = ResultStore(str(tmp_path / "store"))
+    for i in range(3):
+        store.append({'lf': "1812cs103", 'rf': 1.5*i, 'gain': np.arange(4.0) + i})
+    store = ResultStore(str(tmp_path / "store"))
+    assert len(store) == 3
+    assert list(store['lf']) == ["1812cs103"]*3
+    np.testing.assert_array_equal(store['rf'], [0.0, 1.5, 3.0])
+    assert store['gain'].shape == (3, 4)
+    with pytest.raises(ValueError):
+        store.append({'lf': "1812cs103", 'rf': 1.0})
+
+
+def test_result_store_recovers_torn_row(tmp_path):
+    store = ResultStore(str(tmp_path / "store"))
+    store.append({'rf': 1.0, 'gain': np.zeros(4)})
+    store.append({'rf': 2.0, 'gain': np.ones(4)})
+    # 程序在写第三行时退出：rf已经写入，gain只写了一半
+    with open(tmp_path / "store" / "rf.bin", 'ab') as f:
+        f.write(np.float64(3.0).tobytes())
+    with open(tmp_path / "store" / "gain.bin", 'ab') as f:
+        f.write(np.zeros(2).tobytes())
+    store = ResultStore(str(tmp_path / "store"))
+    assert len(store) == 2
+    store.append({'rf': 4.0, 'gain': np.full(4, 4.0)})
+    assert len(store) == 3
+    np.testing.assert_array_equal(store['rf'], [1.0, 2.0, 4.0])
+    np.testing.assert_array_equal(store['gain'][2], np.full(4, 4.0))
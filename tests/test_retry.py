@@ -0,0 +1,81 @@
+# 失败分类和重试梯度：假ngspice输出FAKE_NGSPICE_FAIL的信息，网表中含有FAKE_NGSPICE_UNLESS时才成功
+import pytest
+
+from pyng import NgConvergenceError, NgSimError, RETRY_LADDER, classify_failure, simulation_error
+
+
+@pytest.mark.parametrize("output, kind", [
+    ("doAnalyses: TRAN:  Timestep too small; time = 1e-9", 'timestep_too_small'),
+    ("Error: singular matrix:  check nodes n1 and n2", 'singular_matrix'),
+    ("Warning: Gmin stepping failed", 'gmin_stepping'),
+    ("Warning: source stepping failed", 'source_stepping'),
+    ("Iteration limit reached", 'iteration_limit'),
+    ("Note: run did not converge", 'no_convergence'),
+    ("Total analysis time (seconds) = 0.1", None),
+])
+def test_classify_failure(output, kind):
+    assert classify_failure(output, "") == kind
+    assert classify_failure("", output.upper()) == kind
+
+
+def test_simulation_error():
+    error = simulation_error(1, "TIMESTEP TOO SMALL", "")
+    assert isinstance(error, NgConvergenceError)
+    assert error.kind == 'timestep_too_small' and error.returncode == 1
+    error = simulation_error(2, "", "segfault")
+    assert type(error) is NgSimError and error.kind == "failed"
+
+
+@pytest.fixture
+def failing(fake_ns, monkeypatch):
+    # 只有加入method=gear的第二级梯度才能收敛
+    monkeypatch.setenv("FAKE_NGSPICE_FAIL", "doAnalyses: TRAN:  Timestep too small")
+    monkeypatch.setenv("FAKE_NGSPICE_UNLESS", "method=gear")
+    return fake_ns
+
+
+def test_run_retries(failing):
+    with pytest.raises(NgConvergenceError) as info:
+        failing.run()
+    assert info.value.kind == 'timestep_too_small'
+    failing.retry_ladder = RETRY_LADDER
+    arrs, plots = failing.run()
+    assert all(plot['retry'] == 2 and plot['options'] == RETRY_LADDER[1] for plot in plots)
+    # 梯度中的语句只加入重试的任务，不改变ns的设置
+    assert failing.dot_command_list == [".ac lin 100 1meg 100meg"]
+
+
+def test_run_without_ladder_has_no_flags(fake_ns):
+    arrs, plots = fake_ns.run()
+    assert 'retry' not in plots[0] and 'options' not in plots[0]
+
+
+def test_all_rungs_fail(failing):
+    failing.retry_ladder = [".options reltol=1e-3", ".options gmin=1e-10"]
+    with pytest.raises(NgConvergenceError) as info:
+        failing.run()
+    assert info.value.attempts == ['timestep_too_small']*3
+
+
+def test_run_watch_retries(failing):
+    failing.retry_ladder = RETRY_LADDER
+    arrs, plots = failing.run_watch(lambda arr: False)
+    assert plots[0]['retry'] == 2 and plots[0]['aborted'] is False
+    assert len(arrs[0]) == 100
+
+
+def test_run_many_returns_errors(failing):
+    jobs = [failing.snapshot()]
+    failing.add_dot_command(".options method=gear")
+    jobs.append(failing.snapshot())
+    results = failing.run_many(jobs, max_workers=2, errors="return")
+    assert isinstance(results[0], NgConvergenceError)
+    assert results[0].kind == 'timestep_too_small'
+    arrs, plots = results[1]
+    assert len(arrs[0]) == 100
+    with pytest.raises(NgConvergenceError):
+        failing.run_many(jobs, max_workers=2)
+    # 设置了梯度时两个任务都能完成
+    failing.retry_ladder = RETRY_LADDER
+    results = failing.run_many(jobs, max_workers=2)
+    assert [result[1][0]['retry'] for result in results] == [2, 0]
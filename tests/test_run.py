@@ -0,0 +1,63 @@
+# 使用bench/fake_ngspice.py测试NgSim的运行和结果读取，不需要安装ngspice
+import numpy as np
+import pytest
+from fake_ngspice import synthetic_plots
+
+from pyng import NgTimeoutError, _RawTail
+
+
+def test_run_iter_save_vectors(fake_ns):
+    fake_ns.save_vectors = ['frequency', 'v(n0)']
+    blocks = list(fake_ns.run_iter(chunk_rows=30))
+    assert [len(block) for _, _, block in blocks] == [30, 30, 30, 10]
+    for index, plot, block in blocks:
+        assert plot['varnames'] == ['frequency', 'v(n0)']
+        assert block.dtype.names == ('frequency', 'v(n0)')
+    arrs, plots = fake_ns.run()
+    np.testing.assert_array_equal(np.concatenate([block for _, _, block in blocks]), arrs[0])
+
+
+def test_raw_tail_reads_only_new_rows(tmp_path):
+    # 模拟ngspice边仿真边写raw文件：No. Points在plot结束时才写入
+    plot = synthetic_plots("tran", points=100, n_vars=1)[0]
+    head, data = plot.split(b"Binary:\n", 1)
+    head = head.replace(b"No. Points: 100", b"No. Points: 0  ")
+    row = len(data)//100
+    fname = tmp_path / "out.raw"
+    tail = _RawTail(str(fname))
+    assert tail.read() is None
+    with open(fname, 'wb') as fp:
+        fp.write(head + b"Binary:\n" + data[:30*row + row//2])
+        fp.flush()
+        assert len(tail.read()) == 30
+        assert len(tail.read()) == 0
+        fp.write(data[30*row + row//2:] + plot)
+        fp.seek(head.index(b"No. Points:"))
+        fp.write(b"No. Points: 100")
+    # 之后的plot不再跟踪
+    assert len(tail.read()) == 70
+    assert len(tail.read()) == 0
+    arr, tail_plot = tail.result()
+    assert tail_plot[b'no. points'] == b'100'
+    np.testing.assert_array_equal(arr, np.frombuffer(data[:100*row], dtype=arr.dtype))
+
+
+def test_run_watch_timeout_raises(fake_ns, monkeypatch):
+    monkeypatch.setenv("FAKE_NGSPICE_SLEEP", "5")
+    with pytest.raises(NgTimeoutError):
+        fake_ns.run_watch(lambda arr: False, timeout=0.2)
+
+
+def test_reuse_op_timeout_is_not_rerun_cold(fake_ns, monkeypatch):
+    fake_ns.reuse_op = "nodeset"
+    fake_ns.timeout = 0.2
+    job = fake_ns.snapshot()
+    fake_ns.operating_points[fake_ns._topology(job)] = {'n0': 0.5}
+    runs = []
+    run_once = fake_ns._run_once
+    monkeypatch.setattr(fake_ns, "_run_once", lambda *args, **kwargs: runs.append(args) or run_once(*args, **kwargs))
+    monkeypatch.setenv("FAKE_NGSPICE_SLEEP", "5")
+    with pytest.raises(NgTimeoutError):
+        fake_ns.run()
+    assert len(runs) == 1
+    assert fake_ns.operating_points == {}
@@ -0,0 +1,43 @@
+# run_many：每个任务在working_folder下独立的临时文件夹中运行，结果按提交顺序返回
+import os
+
+import numpy as np
+import pytest
+
+
+def gain(arrs, plots):
+    return np.abs(arrs[0]['v(n0)'][0])
+
+
+def test_run(fake_ns):
+    arrs, plots = fake_ns.run()
+    assert plots[0][b'plotname'] == b'AC Analysis'
+    assert plots[0]['varnames'] == ['frequency', 'v(n0)', 'v(n1)']
+    assert len(arrs[0]) == 100
+    assert gain(arrs, plots) == pytest.approx(1000/abs(1 + 1j/20))
+
+
+def test_run_many_keeps_job_order(fake_ns):
+    jobs = []
+    for value in range(1, 13):
+        fake_ns.add_mod_comp("r1", str(value))
+        jobs.append(fake_ns.snapshot())
+    results = fake_ns.run_many(jobs, max_workers=4)
+    gains = [gain(*result)*abs(1 + 1j/20) for result in results]
+    np.testing.assert_allclose(gains, range(1, 13))
+    completed = dict(fake_ns.run_many(jobs, max_workers=4, as_completed=True))
+    assert sorted(completed) == list(range(12))
+    for i, result in completed.items():
+        assert gain(*result)*abs(1 + 1j/20) == pytest.approx(i + 1)
+    # 临时文件夹在任务结束后删除
+    assert [name for name in os.listdir(fake_ns.working_folder) if name.startswith("job_")] == []
+
+
+def test_relative_includes_resolve_against_working_folder(fake_ns):
+    # 临时文件夹比working_folder深一层，相对路径的include改为绝对路径
+    fake_ns.add_include(".include models.lib")
+    job = fake_ns.snapshot()
+    lines = fake_ns.render_netlist(job, base_folder=os.path.abspath(fake_ns.working_folder))
+    expected = os.path.join(os.path.abspath(fake_ns.working_folder), "models.lib")
+    assert any(expected in line for line in lines)
+    assert not any(expected in line for line in fake_ns.render_netlist(job))
@@ -0,0 +1,89 @@
+# NgSession：假ngspice的-p模式，只改变R/C/L的值时用alter，其他变化重新载入电路；命令超时结束会话
+import os
+import time
+
+import numpy as np
+import pytest
+
+from pyng import NgTimeoutError
+
+
+@pytest.fixture
+def session(fake_ns):
+    session = fake_ns.open_session()
+    sent = []
+    command = session.command
+    session.command = lambda *lines: sent.append(lines) or command(*lines)
+    session.sent = sent
+    yield session
+    session.close()
+
+
+def gain(result):
+    arrs, plots = result
+    return np.abs(arrs[0]['v(n0)'][0])*abs(1 + 1j/20)
+
+
+def test_alter_and_reload(fake_ns, session):
+    assert gain(fake_ns.run()) == pytest.approx(1000)
+    assert session.sent[0] == ("destroy all", "source rc.cir")
+    session.sent.clear()
+    fake_ns.add_mod_comp("r1", "2k")
+    fake_ns.add_mod_comp("c1", "2n")
+    assert gain(fake_ns.run()) == pytest.approx(2000)
+    assert session.sent == [("destroy all", "alter r1 = 2k", "alter c1 = 2n"), ("run out.raw",)]
+    session.sent.clear()
+    # 新的仿真命令需要重新载入，载入后的网表使用当前的元件值
+    fake_ns.add_dot_command(".options reltol=1e-4")
+    assert gain(fake_ns.run()) == pytest.approx(2000)
+    assert session.sent[0] == ("destroy all", "remcirc", "source rc.cir")
+    # 结果与批处理模式相同
+    fake_ns.close_session()
+    assert fake_ns.session is None
+    assert gain(fake_ns.run()) == pytest.approx(2000)
+
+
+def test_needs_reload(fake_ns, session):
+    fake_ns.add_mod_comp("r1", "2k")
+    fake_ns.add_mod_comp("x1", "amp")
+    assert session._needs_reload(fake_ns.snapshot())
+    fake_ns.run()
+    assert not session._needs_reload(fake_ns.snapshot())
+
+    def changed(change):
+        saved = (list(fake_ns.include_list), list(fake_ns.dot_command_list),
+                 dict(fake_ns.component_changes_dict), list(fake_ns.component_delete_list),
+                 fake_ns.save_vectors)
+        change()
+        try:
+            return session._needs_reload(fake_ns.snapshot())
+        finally:
+            (fake_ns.include_list, fake_ns.dot_command_list, fake_ns.component_changes_dict,
+             fake_ns.component_delete_list, fake_ns.save_vectors) = saved
+
+    # R/C/L的新值用alter
+    assert not changed(lambda: fake_ns.add_mod_comp("r1", "3k"))
+    assert not changed(lambda: fake_ns.add_mod_comp("l1", "1u"))
+    # 恢复原值、按字段修改、其他类型的元件和电路结构的变化需要重新载入
+    assert changed(lambda: fake_ns.component_changes_dict.pop("r1"))
+    assert changed(lambda: fake_ns.add_mod_comp("r1", "3k", field=3))
+    assert changed(lambda: fake_ns.add_mod_comp("v5", "2"))
+    assert changed(lambda: fake_ns.add_mod_comp("x1", "amp2"))
+    assert changed(lambda: fake_ns.add_include("models.lib"))
+    assert changed(lambda: fake_ns.add_dot_command(".temp 50"))
+    assert changed(lambda: fake_ns.add_delete_comp("c1"))
+    assert changed(lambda: setattr(fake_ns, "save_vectors", ["frequency", "v(n0)"]))
+
+
+def test_command_timeout(fake_ns, monkeypatch):
+    # ngspice -p在run时挂起：command最多等待ns.timeout秒，然后结束进程并关闭会话
+    monkeypatch.setenv("FAKE_NGSPICE_SLEEP", "30")
+    fake_ns.timeout = 0.5
+    session = fake_ns.open_session()
+    start = time.perf_counter()
+    with pytest.raises(NgTimeoutError, match="timed out after 0.5 s"):
+        fake_ns.run()
+    assert time.perf_counter() - start < 10
+    assert session.process.returncode is not None
+    assert fake_ns.session is None
+    assert not os.path.exists(session.working_folder)
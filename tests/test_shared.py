@@ -0,0 +1,92 @@
+# NgShared的测试：使用tests/ngspice_stub.c编译的假libngspice，不需要安装ngspice
+import os
+import shutil
+import subprocess
+
+import numpy as np
+import pytest
+
+from pyng import NgSim, NgSimError, NgConvergenceError, Sweep, SweepCheck
+
+stub_source = os.path.join(os.path.dirname(os.path.abspath(__file__)), "ngspice_stub.c")
+
+
+@pytest.fixture(scope="session")
+def stub_library(tmp_path_factory):
+    compiler = shutil.which("cc") or shutil.which("gcc")
+    if compiler is None:
+        pytest.skip("no C compiler")
+    library = str(tmp_path_factory.mktemp("stub") / "libngspice_stub.so")
+    subprocess.run([compiler, "-shared", "-fPIC", "-o", library, stub_source, "-lm"], check=True)
+    return library
+
+
+@pytest.fixture
+def ns(tmp_path):
+    netlist = tmp_path / "rc.cir"
+    netlist.write_text("* stub circuit\nV5 in 0 dc 0 ac 1\nR1 in out 1000\nC1 out 0 1n\n.end\n")
+    ns = NgSim(str(netlist), str(tmp_path / "work"), verbose=False)
+    ns.add_dot_command(".ac lin 5 1meg 5meg")
+    yield ns
+    ns.close_session()
+
+
+def expected_out(r1, points=5):
+    f = 1e6*np.arange(1, points + 1)
+    return r1/(1 + 1j*f/1e6)
+
+
+def test_vectors_use_raw_file_names(ns, stub_library):
+    ns.open_shared(stub_library)
+    arrs, plots = ns.run()
+    assert plots[0][b'plotname'] == b'ac1'
+    assert plots[0]['varnames'] == ['frequency', 'v(out)', 'i(v5)']
+    assert plots[0][b'no. points'] == b'5'
+    np.testing.assert_allclose(arrs[0]['v(out)'], expected_out(1000))
+
+
+def test_results_stay_valid_after_next_run(ns, stub_library):
+    # 默认复制数组：solve_for和Sweep保留的旧结果在之后的运行中不会被释放
+    ns.open_shared(stub_library)
+    first, _ = ns.run()
+    ns.add_mod_comp("r1", "2000")
+    second, _ = ns.run()
+    np.testing.assert_allclose(first[0]['v(out)'], expected_out(1000))
+    np.testing.assert_allclose(second[0]['v(out)'], expected_out(2000))
+
+
+def test_copy_false_aliases_ngspice_memory(ns, stub_library):
+    ns.open_shared(stub_library, copy=False)
+    first, _ = ns.run()
+    ns.run()
+    assert np.all(np.isnan(first[0]['v(out)']))
+
+
+def test_save_vectors(ns, stub_library):
+    ns.save_vectors = ['frequency', 'v(out)']
+    ns.open_shared(stub_library)
+    arrs, plots = ns.run()
+    assert plots[0]['varnames'] == ['frequency', 'v(out)']
+
+
+def test_failures_raise_ngsimerror(ns, stub_library):
+    ns.open_shared(stub_library)
+    ns.add_mod_comp("c1", "1n FAILRUN")
+    with pytest.raises(NgConvergenceError) as error:
+        ns.run()
+    assert error.value.kind == "timestep_too_small"
+    ns.add_mod_comp("c1", "1n FAILLOAD")
+    with pytest.raises(NgSimError):
+        ns.run()
+
+
+def test_sweep_skips_failed_points(ns, stub_library):
+    ns.open_shared(stub_library)
+    check = SweepCheck("out", [".ac lin 5 1meg 5meg"],
+                       lambda arrs, plots, row: {'out0': np.abs(arrs[0]['v(out)'][0])},
+                       changes={'c1': "1n"})
+    # r1为FAILRUN的点在ngspice中失败，其余的点正常完成
+    sweep = Sweep(ns, axes={'r1': ["1000", "1000 FAILRUN", "3000"]}, checks=[check], errors="skip")
+    rows = sweep.run()
+    assert [row['r1'] for row in rows] == ["1000", "3000"]
+    assert [failure[2].kind for failure in sweep.failures] == ["timestep_too_small"]
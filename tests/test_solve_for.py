@@ -0,0 +1,32 @@
+# solve_for：割线外推找到区间后用Brent法收敛，候选值按精度量化
+import numpy as np
+import pytest
+
+from pyng import solve_for
+
+
+def gain(arrs, plots):
+    return np.abs(arrs[0]['v(n0)'][0])
+
+
+def test_solve_for_converges(fake_ns):
+    target = 2500*abs(1/(1 + 1j/20))
+    solved = solve_for(fake_ns, "r1", gain, target, bounds=(100, 1e5), tol=0.5, precision=0)
+    assert solved.converged
+    assert solved.x == 2500
+    assert abs(solved.value - target) <= 0.5
+    assert solved.n_sims == len(solved.history) <= 8
+    # ns中的元件设为找到的值
+    assert gain(*fake_ns.run()) == pytest.approx(solved.value)
+
+
+def test_solve_for_side(fake_ns):
+    target = 2500.3*abs(1/(1 + 1j/20))
+    solved = solve_for(fake_ns, "r1", gain, target, bounds=(100, 1e5), tol=1, precision=0, side="above")
+    assert solved.converged and solved.x == 2501
+
+
+def test_solve_for_unreachable_target(fake_ns):
+    # 目标在范围之外时返回最接近目标的边界值，converged为False
+    solved = solve_for(fake_ns, "r1", gain, 1e6, bounds=(100, 1e5), tol=0.5, precision=0)
+    assert not solved.converged and solved.x == 1e5
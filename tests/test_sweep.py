@@ -0,0 +1,69 @@
+# NgSim.sweep：一次ngspice调用中用foreach/alter扫描元件值，按写出顺序把各次运行的plot叠成二维数组
+import numpy as np
+import pytest
+
+from pyng import analysis_control_lines, stack_runs
+
+
+def test_sweep_shape(fake_ns):
+    values = [500, 1000, 2000]
+    stacks, plots = fake_ns.sweep("R1", values)
+    assert len(stacks) == len(plots) == 1
+    assert stacks[0].shape == (len(values), 100)
+    assert plots[0][b'plotname'] == b"AC Analysis"
+    freq = stacks[0]['frequency'].real
+    expected = np.array(values)[:, None]/(1 + 1j*freq/20e6)
+    np.testing.assert_allclose(stacks[0]['v(n0)'], expected)
+    # sweep不改变ns中的设置
+    assert fake_ns.component_changes_dict == {}
+    assert fake_ns.dot_command_list == [".ac lin 100 1meg 100meg"]
+
+
+def test_sweep_noise_plot_order(fake_ns):
+    analyses = [".ac lin 50 1meg 10meg", "noise v(n0) v5 lin 100 1meg 100meg"]
+    stacks, plots = fake_ns.sweep("r1", ["1k", "2k"], analyses=analyses)
+    assert [plot[b'plotname'] for plot in plots] == [
+        b"AC Analysis", b"Noise Spectral Density Curves", b"Integrated Noise"]
+    assert [stack.shape for stack in stacks] == [(2, 100), (2, 100), (2, 1)]
+    np.testing.assert_allclose(stacks[0]['v(n0)'][:, 0], np.array([1000, 2000])/(1 + 1j*1e6/20e6))
+    assert stacks[1].dtype.names == ('frequency', 'onoise_spectrum')
+    assert stacks[2].dtype.names == ('onoise_total',)
+
+
+def test_analysis_control_lines():
+    lines, order = analysis_control_lines([".ac lin 10 1 10", "noise v(out) v1 dec 10 1 1meg", "tran 1n 1u"])
+    assert lines == ["ac lin 10 1 10", "write out.raw",
+                     "noise v(out) v1 dec 10 1 1meg", "write out.raw", "setplot previous", "write out.raw",
+                     "tran 1n 1u", "write out.raw"]
+    # 积分噪声先写出，但在批处理模式的raw文件中排在频谱之后
+    assert order == [0, 2, 1, 3]
+    assert analysis_control_lines(["op"], "x.raw") == (["op", "write x.raw"], [0])
+
+
+def test_stack_runs_pads_with_nan():
+    dtype = [('time', np.float64), ('v(out)', np.float64)]
+    runs = [np.zeros(n, dtype=dtype) for n in (3, 5)]
+    for run in runs:
+        run['time'] = np.arange(len(run))
+    stacks, plots = stack_runs(runs, [{'run': 0}, {'run': 1}], 2)
+    assert len(stacks) == 1 and plots == [{'run': 0}]
+    assert stacks[0].shape == (2, 5)
+    np.testing.assert_array_equal(stacks[0]['time'][0], [0, 1, 2, np.nan, np.nan])
+    np.testing.assert_array_equal(stacks[0]['time'][1], np.arange(5))
+
+
+def test_stack_runs_order():
+    def plot(name, n, value):
+        data = np.empty(n, dtype=[(name, np.float64)])
+        data[name] = value
+        return data
+
+    spectrum, total = plot('onoise_spectrum', 4, 1), plot('onoise_total', 1, 1)
+    # 每次运行先写出积分噪声再写出频谱
+    arrs = [total, spectrum, plot('onoise_total', 1, 2), plot('onoise_spectrum', 4, 2)]
+    stacks, plots = stack_runs(arrs, ['total', 'spectrum']*2, 2, [1, 0])
+    assert plots == ['spectrum', 'total']
+    np.testing.assert_array_equal(stacks[0]['onoise_spectrum'], [[1]*4, [2]*4])
+    np.testing.assert_array_equal(stacks[1]['onoise_total'], [[1], [2]])
+    with pytest.raises(ValueError, match="Expected plots for 3 runs"):
+        stack_runs([total, spectrum], ['total', 'spectrum'], 3)
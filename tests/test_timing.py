@@ -0,0 +1,76 @@
+# 运行耗时记录：成功、失败、超时和重试的每次ngspice调用都记录在timings中
+import json
+
+import numpy as np
+import pytest
+
+from pyng import NgConvergenceError, NgTimeoutError, RETRY_LADDER
+
+
+def test_successful_run(fake_ns):
+    seen = []
+    fake_ns.on_timing = seen.append
+    fake_ns.run()
+    assert seen == fake_ns.timings
+    stats, = fake_ns.timings
+    assert 'error' not in stats
+    assert stats['points'] == 100
+    assert stats['raw_bytes'] > 100*3*16
+    assert stats['analysis'] == stats['elapsed'] == 0
+    for field in ('render', 'write', 'spawn', 'parse'):
+        assert 0 <= stats[field] <= stats['total']
+
+
+def test_failed_and_timed_out_runs(fake_ns, monkeypatch):
+    monkeypatch.setenv("FAKE_NGSPICE_FAIL", "doAnalyses: TRAN:  Timestep too small")
+    with pytest.raises(NgConvergenceError):
+        fake_ns.run()
+    with pytest.raises(NgConvergenceError):
+        fake_ns.run_meas()
+    monkeypatch.delenv("FAKE_NGSPICE_FAIL")
+    monkeypatch.setenv("FAKE_NGSPICE_SLEEP", "5")
+    fake_ns.timeout = 0.5
+    with pytest.raises(NgTimeoutError):
+        fake_ns.run()
+    assert [stats['error'] for stats in fake_ns.timings] == ['timestep_too_small', 'timestep_too_small', 'timeout']
+    assert all('points' not in stats and stats['total'] > 0 for stats in fake_ns.timings)
+    assert fake_ns.timings[-1]['total'] < 5
+
+
+def test_retry_ladder_records_each_call(fake_ns, monkeypatch):
+    # 只有加入method=gear的第二级梯度才能收敛
+    monkeypatch.setenv("FAKE_NGSPICE_FAIL", "Timestep too small")
+    monkeypatch.setenv("FAKE_NGSPICE_UNLESS", "method=gear")
+    fake_ns.retry_ladder = RETRY_LADDER
+    arrs, plots = fake_ns.run()
+    assert plots[0]['retry'] == 2
+    assert [stats.get('error') for stats in fake_ns.timings] == ['timestep_too_small', 'timestep_too_small', None]
+    summary = fake_ns.timing_summary()
+    assert summary['runs'] == 3
+    assert summary['failed'] == 2
+    assert summary['errors'] == {'timestep_too_small': 2}
+    assert summary['points']['count'] == 1
+
+
+def test_timing_summary_and_export(fake_ns, tmp_path):
+    for value in ("1k", "2k", "3k"):
+        fake_ns.add_mod_comp("r1", value)
+        fake_ns.run()
+    summary = fake_ns.timing_summary()
+    assert summary['runs'] == 3 and summary['cached'] == 0 and summary['failed'] == 0
+    total = np.array([stats['total'] for stats in fake_ns.timings])
+    assert summary['total']['count'] == 3
+    assert summary['total']['mean'] == pytest.approx(total.mean())
+    assert summary['total']['p50'] == pytest.approx(np.median(total))
+    assert summary['total']['p95'] == pytest.approx(np.percentile(total, 95))
+    assert summary['total']['sum'] == pytest.approx(total.sum())
+    assert summary['points']['sum'] == 300
+    # 没有记录的项（如cache）不出现在汇总中
+    assert 'cache' not in summary
+    fname = tmp_path / "timings.json"
+    fake_ns.export_timings(str(fname))
+    exported = json.loads(fname.read_text())
+    assert exported['summary'] == summary
+    assert exported['runs'] == fake_ns.timings
+    fake_ns.clear_timings()
+    assert fake_ns.timing_summary() == {'runs': 0, 'cached': 0, 'failed': 0, 'errors': {}}
@@ -0,0 +1,115 @@
+# NgCluster在本机上的重试：连不上的worker、收到任务后断开的worker和正常的worker
+import shutil
+import socket
+import socketserver
+import threading
+
+import numpy as np
+import pytest
+from conftest import fake_ngspice
+
+from pyng import (NgCluster, NgConvergenceError, NgSimError, NgWorker, RETRY_LADDER, _recv_message,
+                  _send_message)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class CrashingWorker:
+    # 像NgWorker一样发出问候，但收到run后直接断开连接
+    def __init__(self):
+        self.runs = 0
+        worker = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                _send_message(self.request, {'ok': True, 'auth': False, 'nonce': ""})
+                header, _ = _recv_message(self.request)
+                if header.get('op') == 'run':
+                    worker.runs += 1
+
+        self.server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.address = self.server.server_address
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def shutdown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def worker(tmp_path):
+    worker = NgWorker(folder=str(tmp_path / "worker"), ngspice=fake_ngspice, token="secret")
+    threading.Thread(target=worker.serve_forever, daemon=True).start()
+    yield worker
+    worker.shutdown()
+
+
+def jobs_for(ns, values):
+    jobs = []
+    for value in values:
+        ns.add_mod_comp("r1", str(value))
+        jobs.append(ns.snapshot())
+    return jobs
+
+
+def test_cluster_retries_on_other_connections(fake_ns, worker):
+    crashing = CrashingWorker()
+    try:
+        cluster = NgCluster([("127.0.0.1", free_port()), crashing.address, worker.address],
+                            retries=3, reconnects=2, token="secret")
+        results = cluster.run_many(fake_ns, jobs_for(fake_ns, range(1, 7)))
+    finally:
+        crashing.shutdown()
+    assert crashing.runs >= 1
+    gains = [np.abs(arrs[0]['v(n0)'][0])*abs(1 + 1j/20) for arrs, plots in results]
+    np.testing.assert_allclose(gains, range(1, 7))
+
+
+def test_cluster_fails_without_live_workers(fake_ns):
+    cluster = NgCluster([("127.0.0.1", free_port(), 2)], reconnects=1)
+    with pytest.raises(ValueError, match="All workers failed"):
+        cluster.run(fake_ns)
+
+
+def test_cluster_rejects_wrong_token(fake_ns, worker):
+    with pytest.raises(ValueError, match="All workers failed"):
+        NgCluster([worker.address], token="wrong", reconnects=0).run(fake_ns)
+
+
+def test_cluster_returns_errors(fake_ns, tmp_path):
+    # ngspice以1退出时每个任务的结果为NgSimError，不中止其他任务
+    failing = NgWorker(folder=str(tmp_path / "failing"), ngspice=shutil.which("false"))
+    threading.Thread(target=failing.serve_forever, daemon=True).start()
+    try:
+        cluster = NgCluster([failing.address])
+        results = cluster.run_many(fake_ns, jobs_for(fake_ns, [1, 2]), errors="return")
+        assert [error.returncode for error in results] == [1, 1]
+        with pytest.raises(NgSimError):
+            cluster.run(fake_ns)
+    finally:
+        failing.shutdown()
+
+
+def test_cluster_retry_ladder(fake_ns, worker, monkeypatch):
+    # 不收敛的任务加入下一级梯度放回队列；只有含method=gear的第二级梯度能收敛
+    monkeypatch.setenv("FAKE_NGSPICE_FAIL", "Timestep too small")
+    monkeypatch.setenv("FAKE_NGSPICE_UNLESS", "method=gear")
+    cluster = NgCluster([(*worker.address, 2)], token="secret")
+    jobs = jobs_for(fake_ns, [1, 2, 3])
+    results = cluster.run_many(fake_ns, jobs, errors="return")
+    assert [error.kind for error in results] == ['timestep_too_small']*3
+    fake_ns.retry_ladder = RETRY_LADDER
+    results = cluster.run_many(fake_ns, jobs)
+    assert [plots[0]['retry'] for arrs, plots in results] == [2]*3
+    assert all(plots[0]['options'] == RETRY_LADDER[1] for arrs, plots in results)
+    gains = [np.abs(arrs[0]['v(n0)'][0])*abs(1 + 1j/20) for arrs, plots in results]
+    np.testing.assert_allclose(gains, [1, 2, 3])
+    fake_ns.retry_ladder = RETRY_LADDER[:1]
+    with pytest.raises(NgConvergenceError) as info:
+        cluster.run(fake_ns, jobs[0])
+    assert info.value.attempts == ['timestep_too_small']*2